@@ -1,15 +1,27 @@
 
 from flask import (Flask, render_template, request,
                    flash, session, redirect,
-                   url_for, jsonify)
-from sendgrid import SendGridAPIClient
+                   url_for, jsonify, g, Response, send_from_directory, has_app_context)
 from sendgrid.helpers.mail import Mail, Attachment, FileContent, FileName, FileType, Disposition
-import sqlite3, random, smtplib, json, re, ssl, certifi, base64,os
+import sqlite3, random, smtplib, json, re, ssl, certifi, base64,os, queue, time, hashlib, hmac, threading
+import http.client
+import csv
+import sys
+import shutil
+import tempfile
+from email.message import EmailMessage
+from functools import wraps
+import click
 from dotenv import load_dotenv
 from urllib.parse import quote
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 from werkzeug.utils import secure_filename
+from markupsafe import Markup, escape
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import image_variants
+import metrics
 
 
 load_dotenv()
@@ -19,9 +31,11 @@ app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_APP_SECRET_KEY", "dev-secret-key")
 INSTANCE_DIR = os.path.join(BASE_DIR, "instance")
 os.makedirs(INSTANCE_DIR, exist_ok=True)
-DATABASE = os.path.join(INSTANCE_DIR, "database.db")
+# DATABASE_PATH points a worker (or benchmark.py) at another database file
+DATABASE = os.getenv("DATABASE_PATH") or os.path.join(INSTANCE_DIR, "database.db")
 app.config['DATABASE'] = DATABASE
-print("Database set to:", app.config.get("DATABASE"))
+# stderr, so CLI commands that write to stdout (catalogue export) stay clean
+print("Database set to:", app.config.get("DATABASE"), file=sys.stderr)
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL")
 AUTHORIZED_CLIENTS=[]
 
@@ -31,18 +45,231 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, "static", "uploads", "products")
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Quotation attachments are private to the client they were sent to, so they
+# live outside static/ and are served by message_attachment()
+ATTACHMENT_FOLDER = os.path.join(INSTANCE_DIR, "attachments")
+os.makedirs(ATTACHMENT_FOLDER, exist_ok=True)
+
+# Timestamps are stored as UTC text ('YYYY-MM-DD HH:MM:SS', the same shape
+# CURRENT_TIMESTAMP produces) so plain string comparisons and indexes work;
+# conversion to UAE time happens only for display.
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOCAL_TZ = ZoneInfo("Asia/Dubai")
+# The same offset for SQLite's datetime() modifiers, where grouping by local
+# day or month has to happen in SQL. Dubai keeps no daylight saving time, so
+# a fixed offset matches LOCAL_TZ all year round.
+LOCAL_UTC_OFFSET = "+4 hours"
+
+
+def utc_timestamp(dt=None):
+    """Format an aware/UTC datetime (default: now) the way timestamps are stored"""
+    dt = dt or datetime.now(timezone.utc)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return dt.strftime(TIMESTAMP_FORMAT)
+
+
+@app.template_filter("local_time")
+def to_local_time(value):
+    """Render a stored UTC timestamp in UAE time"""
+    if not value:
+        return value
+    try:
+        dt = datetime.strptime(str(value)[:19], TIMESTAMP_FORMAT)
+    except ValueError:
+        return value
+    return dt.replace(tzinfo=timezone.utc).astimezone(LOCAL_TZ).strftime(TIMESTAMP_FORMAT)
+
+# =========================
+# DATABASE CONNECTIONS
+# =========================
+# One connection per request is kept in flask.g and handed back to a small
+# per-worker pool on teardown, so helpers called during the same request
+# share it instead of each opening their own.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 134217728",
+)
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_db_pool_pid = os.getpid()
+
+
+def _record_sql_time(started):
+    stats = g.get("sql_stats") if has_app_context() else None
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Adds each statement to the current request's SQL stats.
+
+    Only execute() is timed, which for a SELECT covers finding the first
+    row; the fetch that follows is not counted.
+    """
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _record_sql_time(started)
 
-def init_db():
-    conn = sqlite3.connect(DATABASE)
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _record_sql_time(started)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+def recording_sql_stats():
+    """Requests count their SQL for /metrics, or when a tool such as
+    benchmark.py sets RECORD_SQL_STATS without prometheus_client installed"""
+    return metrics.enabled or app.config.get("RECORD_SQL_STATS", False)
+
+
+def connect_db():
+    """Open a new SQLite connection with the tuned pragmas applied"""
+    conn = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           factory=TimedConnection if recording_sql_stats() else sqlite3.Connection)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _acquire_connection():
+    global _db_pool, _db_pool_pid
+    # Connections must never cross a fork (gunicorn --preload), so a worker
+    # that inherited the parent's pool starts over with an empty one.
+    if _db_pool_pid != os.getpid():
+        _db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        _db_pool_pid = os.getpid()
+    try:
+        return _db_pool.get_nowait()
+    except queue.Empty:
+        return connect_db()
+
+
+def _release_connection(conn):
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        if _db_pool_pid == os.getpid():
+            _db_pool.put_nowait(conn)
+            return
+    except (queue.Full, sqlite3.Error):
+        pass
+    conn.close()
+
+
+def get_db():
+    """Return the connection bound to the current app context"""
+    if "db" not in g:
+        g.db = _acquire_connection()
+    return g.db
+
+
+def dict_cursor(conn):
+    """Cursor yielding sqlite3.Row objects without touching the shared connection"""
     cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    return cursor
+
+
+@app.teardown_appcontext
+def release_db(exception=None):
+    conn = g.pop("db", None)
+    if conn is not None:
+        _release_connection(conn)
+
+
+# =========================
+# METRICS
+# =========================
+# Per-endpoint latency, status codes and SQL use, exposed on /metrics in the
+# Prometheus text format. Registered ahead of the other request hooks so the
+# timer covers them too. Set METRICS_TOKEN to require it as a bearer token.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+@app.before_request
+def start_request_metrics():
+    if recording_sql_stats():
+        g.sql_stats = [0, 0.0]
+    if metrics.enabled:
+        g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get("request_started")
+    if started is None or request.endpoint == "metrics_endpoint":
+        return response
+    # The endpoint name, not the path, keeps label cardinality bounded
+    endpoint = request.endpoint or "unmatched"
+    metrics.REQUEST_LATENCY.labels(request.method, endpoint).observe(time.perf_counter() - started)
+    metrics.REQUESTS.labels(request.method, endpoint, str(response.status_code)).inc()
+    queries, seconds = g.sql_stats
+    metrics.REQUEST_SQL_QUERIES.labels(endpoint).observe(queries)
+    metrics.REQUEST_SQL_TIME.labels(endpoint).observe(seconds)
+    return response
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if not metrics.enabled:
+        return "Not found", 404
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""),
+                                                 f"Bearer {METRICS_TOKEN}"):
+        return "Unauthorized", 401, {"WWW-Authenticate": "Bearer"}
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+# =========================
+# SCHEMA MIGRATIONS
+# =========================
+# Each migration runs once, in order, inside a single write transaction and
+# bumps PRAGMA user_version. Migrations must tolerate databases that were
+# created by the old ad-hoc init_db, hence the IF NOT EXISTS / column checks.
+
+def _table_columns(cursor, table):
+    # table_xinfo, unlike table_info, also lists generated columns
+    cursor.execute(f"PRAGMA table_xinfo({table})")
+    return [column[1] for column in cursor.fetchall()]
+
+
+def _add_missing_columns(cursor, table, columns):
+    existing = _table_columns(cursor, table)
+    for column, column_type in columns:
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def _migration_baseline(cursor):
     cursor.execute("""CREATE TABLE IF NOT EXISTS otps (
                             id INTEGER PRIMARY KEY AUTOINCREMENT,
                             identifier TEXT,
                             otp TEXT,
                             expires_at DATETIME
                         )""")
-
-    # Create tables if they don't exist
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -54,19 +281,13 @@ def init_db():
         user_type TEXT DEFAULT 'client'
     )
     """)
-
-    # Check if new columns exist and add them if they don't
-    cursor.execute("PRAGMA table_info(users)")
-    columns = [column[1] for column in cursor.fetchall()]
-    for column, column_type in [
+    _add_missing_columns(cursor, "users", [
         ('client_name', 'TEXT'),
         ('phone', 'TEXT'),
         ('address', 'TEXT'),
         ('company', 'TEXT'),
         ('user_type', "TEXT DEFAULT 'client'")
-    ]:
-        if column not in columns:
-            cursor.execute(f"ALTER TABLE users ADD COLUMN {column} {column_type}")
+    ])
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS products (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -87,22 +308,29 @@ def init_db():
                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
            )
        """)
-    # Insert the main admin if not exists
-    main_admin_email = os.getenv("ADMIN_EMAIL")
-    if main_admin_email:
-        cursor.execute("INSERT OR IGNORE INTO admins (email) VALUES (?)", (main_admin_email.lower(),))
+    # Column order matches the production table; the client-orders view
+    # still reads these rows by position.
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS orders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_name TEXT,
+            product_id INTEGER,
             expected_date TEXT,
             quantity TEXT,
             comments TEXT,
             user_email TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            product_name TEXT,
+            status TEXT DEFAULT 'inquiry received',
+            last_updated TEXT,
+            payment_status TEXT DEFAULT 'unpaid'
         )
         """)
-
+    _add_missing_columns(cursor, "orders", [
+        ('product_name', 'TEXT'),
+        ('status', "TEXT DEFAULT 'inquiry received'"),
+        ('last_updated', 'TEXT'),
+        ('payment_status', "TEXT DEFAULT 'unpaid'")
+    ])
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS messages (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -114,18 +342,674 @@ def init_db():
         order_name TEXT,
         order_quantity TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_read BOOLEAN DEFAULT 0,
         FOREIGN KEY (order_id) REFERENCES orders(id)
     )
     """)
-    conn.commit()
-    conn.close()
+    _add_missing_columns(cursor, "messages", [
+        ('is_read', 'BOOLEAN DEFAULT 0')
+    ])
+    # Normalise legacy NULLs so unread lookups can be a plain indexed equality
+    cursor.execute("UPDATE messages SET is_read = 0 WHERE is_read IS NULL")
+    cursor.execute("UPDATE orders SET payment_status = 'unpaid' WHERE payment_status IS NULL")
+
+
+def _migration_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_last_updated ON orders(status, last_updated)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_email, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_read ON messages(user_email, is_read)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category_name ON products(category, product_name)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_admins_email ON admins(email)")
+
+
+def _create_version_triggers(cursor, table):
+    """Bump data_versions[table] on every insert, update and delete"""
+    cursor.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, 0)", (table,))
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+            END
+        """)
+
+
+def _migration_data_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    _create_version_triggers(cursor, "admins")
+
+
+def _migration_table_versions(cursor):
+    for table in ("orders", "products", "users"):
+        _create_version_triggers(cursor, table)
+
+
+def _migration_order_product_ids(cursor):
+    _add_missing_columns(cursor, "orders", [
+        ('product_id', 'INTEGER REFERENCES products(id)')
+    ])
+    # Resolve legacy rows by name once; duplicate names resolve to the oldest product
+    cursor.execute("""
+        UPDATE orders
+        SET product_id = (
+            SELECT MIN(p.id) FROM products p
+            WHERE LOWER(p.product_name) = LOWER(orders.product_name)
+        )
+        WHERE product_id IS NULL
+           OR product_id NOT IN (SELECT id FROM products)
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_product_id ON orders(product_id)")
+
+
+def _migration_utc_timestamps(cursor):
+    # last_updated used to be written as UAE wall time (now +4h); store UTC
+    cursor.execute("""
+        UPDATE orders SET last_updated = datetime(last_updated, '-4 hours')
+        WHERE datetime(last_updated) IS NOT NULL
+    """)
+    cursor.execute("UPDATE orders SET last_updated = created_at WHERE last_updated IS NULL")
+    for table in ("orders", "messages"):
+        cursor.execute(f"""
+            UPDATE {table} SET created_at = datetime(created_at)
+            WHERE datetime(created_at) IS NOT NULL AND created_at != datetime(created_at)
+        """)
+    _add_missing_columns(cursor, "orders", [
+        ('created_month', 'TEXT GENERATED ALWAYS AS (substr(created_at, 1, 7)) VIRTUAL'),
+    ])
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_month ON orders(created_month, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_last_updated ON orders(last_updated)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_created ON messages(user_email, created_at)")
+
+
+def _migration_email_outbox(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email TEXT NOT NULL,
+            from_email TEXT,
+            subject TEXT NOT NULL,
+            html_content TEXT,
+            plain_text_content TEXT,
+            attachment_path TEXT,
+            attachment_name TEXT,
+            attachment_type TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            next_attempt_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_at TEXT,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            sent_at TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, next_attempt_at)")
+
+
+def _migration_message_versions(cursor):
+    _create_version_triggers(cursor, "messages")
+
+
+def _migration_unread_counters(cursor):
+    # One row per user kept exact by triggers, so every write path (and every
+    # worker) maintains it without having to remember to
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS unread_counters (
+            user_email TEXT PRIMARY KEY,
+            unread INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("DELETE FROM unread_counters")
+    cursor.execute("""
+        INSERT INTO unread_counters (user_email, unread)
+        SELECT user_email, COUNT(*) FROM messages
+        WHERE is_read = 0 AND user_email IS NOT NULL
+        GROUP BY user_email
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_messages_unread_insert
+        AFTER INSERT ON messages
+        WHEN NEW.is_read = 0 AND NEW.user_email IS NOT NULL
+        BEGIN
+            INSERT INTO unread_counters (user_email, unread) VALUES (NEW.user_email, 1)
+            ON CONFLICT(user_email) DO UPDATE SET unread = unread + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_messages_unread_update
+        AFTER UPDATE OF is_read, user_email ON messages
+        WHEN (OLD.is_read = 0) != (NEW.is_read = 0) OR OLD.user_email IS NOT NEW.user_email
+        BEGIN
+            UPDATE unread_counters SET unread = unread - 1
+            WHERE OLD.is_read = 0 AND user_email = OLD.user_email;
+            INSERT INTO unread_counters (user_email, unread)
+            SELECT NEW.user_email, 1 WHERE NEW.is_read = 0 AND NEW.user_email IS NOT NULL
+            ON CONFLICT(user_email) DO UPDATE SET unread = unread + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_messages_unread_delete
+        AFTER DELETE ON messages
+        WHEN OLD.is_read = 0
+        BEGIN
+            UPDATE unread_counters SET unread = unread - 1 WHERE user_email = OLD.user_email;
+        END
+    """)
+
+
+def _migration_image_variants(cursor):
+    _add_missing_columns(cursor, "products", [
+        ('image_variants', 'TEXT')
+    ])
+
+
+def _create_file_ref_triggers(cursor, table, column):
+    """Keep stored_files.ref_count in step with `table.column` references"""
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{column}_ref_insert
+        AFTER INSERT ON {table}
+        WHEN NEW.{column} IS NOT NULL
+        BEGIN
+            UPDATE stored_files SET ref_count = ref_count + 1 WHERE filename = NEW.{column};
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{column}_ref_update
+        AFTER UPDATE OF {column} ON {table}
+        WHEN OLD.{column} IS NOT NEW.{column}
+        BEGIN
+            UPDATE stored_files SET ref_count = ref_count - 1 WHERE filename = OLD.{column};
+            UPDATE stored_files SET ref_count = ref_count + 1 WHERE filename = NEW.{column};
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{column}_ref_delete
+        AFTER DELETE ON {table}
+        WHEN OLD.{column} IS NOT NULL
+        BEGIN
+            UPDATE stored_files SET ref_count = ref_count - 1 WHERE filename = OLD.{column};
+        END
+    """)
+
+
+def _migration_stored_files(cursor):
+    # Legacy uploads are registered under their existing names (sha256 NULL)
+    # so reference counting covers them too; `flask uploads-dedupe` renames them.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stored_files (
+            filename TEXT PRIMARY KEY,
+            sha256 TEXT,
+            size INTEGER,
+            content_type TEXT,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        INSERT OR IGNORE INTO stored_files (filename, ref_count)
+        SELECT name, COUNT(*) FROM (
+            SELECT image_filename AS name FROM products
+            UNION ALL
+            SELECT attachment_name FROM messages
+        )
+        WHERE name IS NOT NULL AND name != ''
+        GROUP BY name
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stored_files_unreferenced ON stored_files(ref_count) WHERE ref_count <= 0")
+    _create_file_ref_triggers(cursor, "products", "image_filename")
+    _create_file_ref_triggers(cursor, "messages", "attachment_name")
+
+
+def _product_options_text(column):
+    # "Key value Key value ..." from the options JSON; malformed JSON indexes as nothing
+    return f"""(
+        SELECT group_concat(key || ' ' || value, ' ')
+        FROM json_each(CASE WHEN json_valid({column}) THEN {column} ELSE '{{}}' END)
+    )"""
+
+
+def _migration_product_search(cursor):
+    # Stored (not external-content) so snippet() can quote the flattened options
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            product_name, category, options,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    cursor.execute("DELETE FROM products_fts")
+    cursor.execute(f"""
+        INSERT INTO products_fts (rowid, product_name, category, options)
+        SELECT id, product_name, category, {_product_options_text("product_options")}
+        FROM products
+    """)
+    insert_new = f"""
+            INSERT INTO products_fts (rowid, product_name, category, options)
+            VALUES (NEW.id, NEW.product_name, NEW.category, {_product_options_text("NEW.product_options")});
+    """
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert
+        AFTER INSERT ON products
+        BEGIN
+            {insert_new}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_update
+        AFTER UPDATE OF id, product_name, category, product_options ON products
+        BEGIN
+            DELETE FROM products_fts WHERE rowid = OLD.id;
+            {insert_new}
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete
+        AFTER DELETE ON products
+        BEGIN
+            DELETE FROM products_fts WHERE rowid = OLD.id;
+        END
+    """)
+
+
+def _product_attribute_rows(id_expr, options_expr, from_table=""):
+    """SELECT of (product_id, key, value, numeric_value) for a product's scalar options.
+
+    numeric_value is the value's leading number ("16mm" -> 16, "0-70mtr/min"
+    -> 0) or NULL when it does not start with one.
+    """
+    return f"""
+        SELECT {id_expr}, trim(key), trim(value),
+               CASE WHEN trim(value) GLOB '[0-9]*' OR trim(value) GLOB '[.-][0-9]*'
+                    THEN CAST(trim(value) AS REAL) END
+        FROM {from_table}json_each(CASE WHEN json_valid({options_expr})
+                            THEN CASE WHEN json_type({options_expr}) = 'object' THEN {options_expr} END END)
+        WHERE type IN ('text', 'integer', 'real') AND trim(key) != '' AND trim(value) != ''
+    """
+
+
+def _migration_product_attributes(cursor):
+    # Scalar product_options entries as rows, kept in step by triggers like
+    # products_fts; nested option groups are not facets and are left out
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS product_attributes (
+            product_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            numeric_value REAL,
+            PRIMARY KEY (product_id, key)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_attributes_value ON product_attributes(key, value, product_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_attributes_numeric ON product_attributes(key, numeric_value, product_id)")
+    cursor.execute("DELETE FROM product_attributes")
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO product_attributes (product_id, key, value, numeric_value)
+        {_product_attribute_rows("p.id", "p.product_options", from_table="products p, ")}
+    """)
+    insert_new = f"""
+            INSERT OR IGNORE INTO product_attributes (product_id, key, value, numeric_value)
+            {_product_attribute_rows("NEW.id", "NEW.product_options")};
+    """
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_products_attributes_insert
+        AFTER INSERT ON products
+        BEGIN
+            {insert_new}
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_products_attributes_update
+        AFTER UPDATE OF id, product_options ON products
+        BEGIN
+            DELETE FROM product_attributes WHERE product_id = OLD.id;
+            {insert_new}
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_products_attributes_delete
+        AFTER DELETE ON products
+        BEGIN
+            DELETE FROM product_attributes WHERE product_id = OLD.id;
+        END
+    """)
+
+
+def _migration_local_order_months(cursor):
+    # created_month was the UTC month, so orders placed late on the last day
+    # of a month (UAE time) landed in the previous one on the timeline; the
+    # never-queried created_day from migration 6 goes with it
+    cursor.execute("DROP INDEX IF EXISTS idx_orders_created_day")
+    cursor.execute("DROP INDEX IF EXISTS idx_orders_created_month")
+    existing = _table_columns(cursor, "orders")
+    for column in ("created_day", "created_month"):
+        if column in existing:
+            cursor.execute(f"ALTER TABLE orders DROP COLUMN {column}")
+    cursor.execute(f"""
+        ALTER TABLE orders ADD COLUMN created_month TEXT
+        GENERATED ALWAYS AS (substr(datetime(created_at, '{LOCAL_UTC_OFFSET}'), 1, 7)) VIRTUAL
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_month ON orders(created_month, created_at)")
+
+
+# Categories live in the categories table from migration 13 on; this is only
+# what it is seeded with (the old manage-products list, which matches the
+# names products actually use). Products in no registered category are shown
+# under FALLBACK_CATEGORY, which cannot be renamed or deleted.
+SEED_CATEGORIES = [
+    "Winches", "Cable Drum Trailers", "Rollers", "Cable Drum Lifting Jacks", "Cable Locators", "Reeling Machine",
+    "Cable Pulling Grips & Swivel Link", "Duct Rods", "Hydraulic Cutting and Crimping Tools",
+    "Warning Tapes", "Manhole", "Ropes", "Duct",
+    "Electrical", "Solar", "Pipes", "Optical Fibre Cables",
+    "Optical Fiber Connectors", "Optical Fiber Adapters", "Optical Fiber Consumable",
+    "Optical Fiber Instruments", "Optical Distribution Frames", "Optical Fiber Patch Cord",
+    "Optical Fibre Tools", "Cabinets", "Cable Joint Products", "Cable & Wires", "Connectors",
+    "Distribution Boxes", "Ducts Accessories", "Manhole Accessories", "Marking & Protection", "Earthing Hardware",
+    "Miscellaneous", "Poles & Accessories", "Tapes", "Terminal Blocks", "Test & Measurement",
+    "Telecom Tools", "Other Products"
+]
+FALLBACK_CATEGORY = "Other Products"
+
+
+def category_key(name):
+    """Normalized category name: products match a category on this key"""
+    return " ".join((name or "").split()).casefold()
+
+
+def _migration_categories(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            key TEXT NOT NULL UNIQUE,
+            position INTEGER NOT NULL,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_categories_position ON categories(position)")
+    names = [name for name in SEED_CATEGORIES if name != FALLBACK_CATEGORY]
+    # Categories products already use but the old lists missed get their own entry
+    seeded = {category_key(name) for name in SEED_CATEGORIES}
+    for (name,) in cursor.execute("SELECT DISTINCT category FROM products ORDER BY category").fetchall():
+        if category_key(name) and category_key(name) not in seeded:
+            names.append(" ".join(name.split()))
+            seeded.add(category_key(name))
+    names.append(FALLBACK_CATEGORY)
+    cursor.executemany(
+        "INSERT OR IGNORE INTO categories (name, key, position) VALUES (?, ?, ?)",
+        [(name, category_key(name), position) for position, name in enumerate(names, 1)])
+    _create_version_triggers(cursor, "categories")
+
+
+MIGRATIONS = [
+    (1, "baseline schema", _migration_baseline),
+    (2, "secondary indexes", _migration_indexes),
+    (3, "data version counters", _migration_data_versions),
+    (4, "orders/products/users version counters", _migration_table_versions),
+    (5, "orders.product_id backfill", _migration_order_product_ids),
+    (6, "UTC timestamps and month column", _migration_utc_timestamps),
+    (7, "email outbox", _migration_email_outbox),
+    (8, "messages version counter", _migration_message_versions),
+    (9, "materialized unread counters", _migration_unread_counters),
+    (10, "product image variants", _migration_image_variants),
+    (11, "content-addressed upload store", _migration_stored_files),
+    (12, "product full-text search", _migration_product_search),
+    (13, "categories registry", _migration_categories),
+    (14, "product attributes", _migration_product_attributes),
+    (15, "UAE-time order months", _migration_local_order_months),
+]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate_db():
+    """Apply pending migrations; safe to run from several workers at once"""
+    conn = connect_db()
+    try:
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent workers
+        # queue here and re-read the version once they get their turn.
+        conn.execute("BEGIN IMMEDIATE")
+        current = get_schema_version(conn)
+        cursor = conn.cursor()
+        applied = []
+        for version, name, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            migrate(cursor)
+            cursor.execute(f"PRAGMA user_version = {version}")
+            applied.append(f"{version} ({name})")
+        conn.commit()
+        if applied:
+            print("Applied migrations:", ", ".join(applied), file=sys.stderr)
+        return applied
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def init_db():
+    migrate_db()
+    # Insert the main admin if not exists
+    main_admin_email = os.getenv("ADMIN_EMAIL")
+    if main_admin_email:
+        conn = connect_db()
+        try:
+            conn.execute("INSERT OR IGNORE INTO admins (email) VALUES (?)", (main_admin_email.lower(),))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Apply pending schema migrations"""
+    init_db()
+    print("Database schema at version", MIGRATIONS[-1][0])
+
+
+if os.getenv("AUTO_MIGRATE", "1") == "1":
+    init_db()
+
+
+def get_data_version(name):
+    """Change counter for a table, shared by every worker through the database"""
+    row = get_db().execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def get_data_versions(*names):
+    placeholders = ", ".join("?" for _ in names)
+    rows = get_db().execute(
+        f"SELECT name, version FROM data_versions WHERE name IN ({placeholders})", names).fetchall()
+    versions = dict(rows)
+    return tuple(versions.get(name, 0) for name in names)
+
+
+def conditional_json(*tables, max_staleness=None):
+    """Answer If-None-Match with 304 when none of `tables` changed.
+
+    The ETag is derived from the request path/query, the caller and the
+    tables' version counters, so a revalidation costs one small lookup
+    instead of the query plus JSON encoding. Views whose result also depends
+    on the clock (e.g. the rolling week) pass max_staleness in seconds to
+    roll the tag over.
+
+    A 304 skips the view, so this goes below the route's access guard
+    (@login_required, @admin_required). As a backstop, anonymous requests
+    always run the view and get no ETag, and a tag only matches for the user
+    it was issued to, so a 304 never tells anyone more than their last 200.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not session.get("authenticated"):
+                return view(*args, **kwargs)
+            parts = [request.full_path, str(session.get("user_email")),
+                     *map(str, get_data_versions(*tables))]
+            if max_staleness:
+                parts.append(str(int(time.time() // max_staleness)))
+            etag = hashlib.sha1("|".join(parts).encode()).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            response.headers["Cache-Control"] = "private, no-cache"
+            return response
+        return wrapped
+    return decorator
+
+
+# Order lists are paged by keyset on (last_updated, id) so a page costs the
+# same however deep into the history it is; the opaque cursor encodes the
+# last row served and travels in the X-Next-Cursor header.
+ORDERS_PAGE_SIZE = int(os.getenv("ORDERS_PAGE_SIZE", "100"))
+ORDERS_MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(last_updated, row_id):
+    return base64.urlsafe_b64encode(json.dumps([last_updated, row_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(value):
+    """Inverse of encode_cursor; raises ValueError on anything malformed"""
+    try:
+        last_updated, row_id = json.loads(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+        return str(last_updated), int(row_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def page_args():
+    """Read ?limit= and ?cursor= for a keyset-paged order list"""
+    limit = request.args.get("limit", ORDERS_PAGE_SIZE, type=int)
+    cursor = request.args.get("cursor")
+    return max(1, min(limit, ORDERS_MAX_PAGE_SIZE)), decode_cursor(cursor) if cursor else None
+
+
+def fetch_orders_page(cur, columns, statuses=None, where=None, params=(), after=None, limit=ORDERS_PAGE_SIZE):
+    """One page of orders newest-first; `columns` must start with id, last_updated.
+
+    Several statuses become one UNION ALL arm each, which SQLite merges
+    straight off idx_orders_status_last_updated instead of sorting every
+    match. Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    clauses, arm_params = [], []
+    if where:
+        clauses.append(f"({where})")
+        arm_params.extend(params)
+    if after:
+        clauses.append("(last_updated, id) < (?, ?)")
+        arm_params.extend(after)
+    arms, query_params = [], []
+    for status in statuses or (None,):
+        arm_clauses = (["status = ?"] if status is not None else []) + clauses
+        arm = f"SELECT {columns} FROM orders"
+        if arm_clauses:
+            arm += " WHERE " + " AND ".join(arm_clauses)
+        arms.append(arm)
+        query_params.extend(([status] if status is not None else []) + arm_params)
+    query = " UNION ALL ".join(arms) + " ORDER BY last_updated DESC, id DESC LIMIT ?"
+    cur.execute(query, (*query_params, limit + 1))
+    rows = cur.fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(last[1], last[0])
+
+
+def with_next_cursor(response, next_cursor):
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+
+# =========================
+# AUTHORIZATION
+# =========================
+# Admin emails are cached per worker as (version, emails, loaded_at). Every
+# role check compares the shared admins version (one primary-key lookup), so
+# a removed admin loses access in all workers on their next request. The set
+# is also reloaded after ADMIN_CACHE_TTL seconds in case the table changed
+# without the version moving, e.g. a restored database file.
+ADMIN_CACHE_TTL = float(os.getenv("ADMIN_CACHE_TTL", "30"))
+_admin_cache = (None, frozenset(), 0.0)
+
+
+def get_admin_emails():
+    global _admin_cache
+    cached_version, emails, loaded_at = _admin_cache
+    now = time.monotonic()
+    version = get_data_version("admins")
+    if version == cached_version and now - loaded_at < ADMIN_CACHE_TTL:
+        return emails
+    rows = get_db().execute("SELECT email FROM admins").fetchall()
+    emails = frozenset(row[0].lower() for row in rows)
+    _admin_cache = (version, emails, now)
+    return emails
+
+
+def invalidate_admin_cache():
+    global _admin_cache
+    _admin_cache = (None, frozenset(), 0.0)
+
+
+def is_admin_in_db(email):
+    """Check if the email belongs to an admin"""
+    if not email:
+        return False
+    return email.lower() in get_admin_emails()
+
+
+def login_required(view):
+    """Route guard for JSON endpoints any logged-in user may call.
+
+    Goes above @conditional_json so an anonymous request is refused before
+    its If-None-Match is ever compared.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not session.get("authenticated"):
+            return jsonify({"error": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def admin_required(view):
+    """Route guard for admin pages and admin-only JSON endpoints"""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        is_api = request.path.startswith("/api/")
+        if not session.get("authenticated"):
+            if is_api:
+                return jsonify({"error": "Unauthorized"}), 401
+            flash("Please login to access the admin panel")
+            return redirect(url_for("login"))
+        if not is_admin_in_db(session.get("user_email")):
+            session["is_admin"] = False
+            if is_api:
+                return jsonify({"error": "Unauthorized"}), 401
+            flash("Admin access required")
+            return redirect(url_for("dashboard"))
+        return view(*args, **kwargs)
+    return wrapped
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def add_client(email, client_name, phone, address, company):
     """Add a new client to the database"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     try:
         cursor.execute("""INSERT INTO users (email, client_name, phone, address, company, user_type) 
@@ -134,12 +1018,12 @@ def add_client(email, client_name, phone, address, company):
         conn.commit()
         return True
     except sqlite3.IntegrityError:
+        conn.rollback()
         return False # Email already exists
     except Exception as e:
+        conn.rollback()
         print(f"Database error: {e}")
         return False
-    finally:
-        conn.close()
 
 def validate_email(email):
     """Validate email format"""
@@ -157,36 +1041,33 @@ def validate_phone(phone):
 
 def get_all_clients():
     """Get all clients from the database"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT id, email, client_name, phone, address, company FROM users WHERE user_type = 'client'")
     clients = cursor.fetchall()
-    conn.close()
     return clients
 
 
 def delete_client(client_id):
     """Delete a client from the database"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM users WHERE id = ? AND user_type = 'client'", (client_id,))
     conn.commit()
-    conn.close()
 
 
 def get_client_by_id(client_id):
     """Get a single client by ID"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT id, email, client_name, phone, address, company FROM users WHERE id = ? AND user_type = 'client'", (client_id,))
     client = cursor.fetchone()
-    conn.close()
     return client
 
 
 def update_client(client_id, email, client_name, phone, address, company):
     """Update a client's information"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     try:
         cursor.execute("""UPDATE users SET email = ?, client_name = ?, phone = ?, address = ?, company = ? 
@@ -195,38 +1076,19 @@ def update_client(client_id, email, client_name, phone, address, company):
         conn.commit()
         return True
     except sqlite3.IntegrityError:
+        conn.rollback()
         return False  # Email already exists for another client
-    finally:
-        conn.close()
 @app.route("/admin/edit-client/<int:client_id>")
+@admin_required
 def edit_client_route(client_id):
     """Edit client route - redirects to manage_clients with edit parameter"""
-    if not session.get("authenticated"):
-        session.clear()
-        flash("Please login to access the admin panel")
-        return redirect(url_for("login"))
-    user_email = session.get("user_email")
-    if not user_email or not is_admin_in_db(user_email):
-        session.clear()
-        flash("Admin access required")
-        return redirect(url_for("login"))
     return redirect(url_for("manage_clients", edit=client_id))
 
 
 @app.route("/admin/manage-clients", methods=["GET", "POST"])
+@admin_required
 def manage_clients():
     """Manage clients section - requires admin authentication"""
-    if not session.get("authenticated"):
-        session.clear()
-        flash("Please login to access the admin panel")
-        return redirect(url_for("login"))
-
-    user_email = session.get("user_email")
-    if not user_email or not is_admin_in_db(user_email):
-        session.clear()
-        flash("Admin access required")
-        return redirect(url_for("login"))
-
     # Handle edit client request
     edit_client = None
     if request.args.get("edit"):
@@ -270,56 +1132,404 @@ def manage_clients():
     return render_template("admin.html", section="manage-clients", clients=clients, edit_client=edit_client)
 
 @app.route("/admin/delete-client/<int:client_id>", methods=["POST"])
+@admin_required
 def delete_client_route(client_id):
     """Delete a client - requires admin authentication"""
-    if not session.get("authenticated"):
-        session.clear()
-        flash("Please login to access the admin panel")
-        return redirect(url_for("login"))
-
-    user_email = session.get("user_email")
-    if not user_email or not is_admin_in_db(user_email):
-        session.clear()
-        flash("Admin access required")
-        return redirect(url_for("login"))
-
     delete_client(client_id)
     flash("Client deleted successfully!")
     return redirect(url_for("manage_clients"))
 
 def is_authorized_client(email):
     """Check if the email belongs to an authorized client"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT email FROM users WHERE email = ? AND user_type = 'client'", (email,))
     result = cursor.fetchone()
-    conn.close()
     return result is not None or email in AUTHORIZED_CLIENTS
 
-def send_email(receiver, content, subject="Elfit Arabia Login OTP"):
-    api_key = os.getenv("SENDGRID_API_KEY")
-    sender = os.getenv("SENDER_GMAIL_ADDRS")
+# =========================
+# EMAIL TRANSPORT
+# =========================
+# Every outgoing email is handed to one transport chosen by EMAIL_BACKEND:
+#   sendgrid - v3 API over a kept-alive HTTPS connection per worker thread
+#   smtp     - a local sink such as MailHog or `python -m aiosmtpd -n`
+#   memory   - kept in RecordingTransport.sent, for load tests and the shell
+#   file     - appended as JSON lines to EMAIL_RECORD_FILE
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "sendgrid").lower()
+EMAIL_HTTP_TIMEOUT = float(os.getenv("EMAIL_HTTP_TIMEOUT", "30"))
+_email_transport = None
+_email_transport_pid = None
+_email_transport_lock = threading.Lock()
+
+
+def default_sender():
+    return os.getenv("SENDER_GMAIL_ADDRS") or os.getenv("ADMIN_EMAIL")
+
+
+class EmailTransport:
+    """Base transport; subclasses implement send() for one message dict"""
+
+    def missing_configuration(self):
+        """Return a reason the transport cannot send, or None"""
+        return None
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def _read_attachment(self, message):
+        with open(message["attachment_path"], "rb") as f:
+            return f.read()
+
+
+class SendGridTransport(EmailTransport):
+    host = "api.sendgrid.com"
+    attachment_placeholder = "@@attachment-content@@"
+    base64_chunk_size = 3 * 256 * 1024
+
+    def __init__(self, api_key, timeout=EMAIL_HTTP_TIMEOUT):
+        self.api_key = api_key
+        self.timeout = timeout
+        self._ssl_context = ssl.create_default_context(cafile=certifi.where())
+        self._local = threading.local()
+
+    def missing_configuration(self):
+        if not self.api_key or not os.getenv("SENDER_GMAIL_ADDRS"):
+            return "Missing SendGrid credentials"
+        return None
+
+    def _connection(self):
+        # http.client reopens the socket by itself once the server closes it,
+        # so each thread keeps one connection and reuses the TLS session
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPSConnection(self.host, timeout=self.timeout, context=self._ssl_context)
+            self._local.conn = conn
+        return conn
+
+    def _build_payload(self, message):
+        """Return (content_length, body) where body() yields the JSON request in pieces.
+
+        The attachment is base64-encoded straight from disk a chunk at a time,
+        so a large quotation is never held in memory whole, let alone encoded.
+        """
+        mail_fields = {}
+        if message["html_content"] is not None:
+            mail_fields["html_content"] = message["html_content"]
+        if message["plain_text_content"] is not None:
+            mail_fields["plain_text_content"] = message["plain_text_content"]
+        mail = Mail(
+            from_email=message["from_email"],
+            to_emails=message["to_email"],
+            subject=message["subject"],
+            **mail_fields
+        )
+        attachment_path = message["attachment_path"]
+        if attachment_path:
+            mail.add_attachment(Attachment(
+                FileContent(self.attachment_placeholder),
+                FileName(message["attachment_name"]),
+                FileType(message["attachment_type"] or "application/octet-stream"),
+                Disposition("attachment")
+            ))
+        payload = json.dumps(mail.get()).encode()
+        if not attachment_path:
+            return len(payload), lambda: iter((payload,))
+
+        head, tail = payload.split(self.attachment_placeholder.encode(), 1)
+        encoded_size = 4 * ((os.path.getsize(attachment_path) + 2) // 3)
+
+        def body():
+            yield head
+            with open(attachment_path, "rb") as f:
+                # Multiples of 3 bytes encode without padding, so chunks concatenate
+                for chunk in iter(lambda: f.read(self.base64_chunk_size), b""):
+                    yield base64.b64encode(chunk)
+            yield tail
+
+        return len(head) + encoded_size + len(tail), body
+
+    def send(self, message):
+        reason = self.missing_configuration()
+        if reason:
+            raise Exception(reason)
+        content_length, body = self._build_payload(message)
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Content-Length": str(content_length),
+            "Accept": "application/json",
+        }
+        conn = self._connection()
+        # An idle keep-alive socket may have been dropped by the server; that
+        # fails before anything is sent, so one retry on a fresh socket is safe
+        reused = conn.sock is not None
+        try:
+            conn.request("POST", "/v3/mail/send", body=body(), headers=headers)
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            conn.close()
+            if not reused:
+                raise
+            conn.request("POST", "/v3/mail/send", body=body(), headers=headers)
+            response = conn.getresponse()
+        except Exception:
+            conn.close()
+            raise
+        response.read()
+        if response.status not in (200, 202):
+            raise Exception(f"SendGrid error: {response.status}")
+
+
+class SMTPTransport(EmailTransport):
+    def __init__(self, host, port, username=None, password=None, use_tls=False, timeout=EMAIL_HTTP_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls(context=ssl.create_default_context(cafile=certifi.where()))
+        if self.username:
+            server.login(self.username, self.password)
+        self._local.server = server
+        return server
+
+    def _build_message(self, message):
+        email = EmailMessage()
+        email["From"] = message["from_email"]
+        email["To"] = message["to_email"]
+        email["Subject"] = message["subject"]
+        email.set_content(message["plain_text_content"] or "")
+        if message["html_content"] is not None:
+            email.add_alternative(message["html_content"], subtype="html")
+        if message["attachment_path"]:
+            maintype, _, subtype = (message["attachment_type"] or "application/octet-stream").partition("/")
+            email.add_attachment(self._read_attachment(message), maintype=maintype,
+                                 subtype=subtype or "octet-stream", filename=message["attachment_name"])
+        return email
+
+    def send(self, message):
+        email = self._build_message(message)
+        server = getattr(self._local, "server", None) or self._connect()
+        try:
+            server.send_message(email)
+        except smtplib.SMTPServerDisconnected:
+            self._connect().send_message(email)
+
+
+class RecordingTransport(EmailTransport):
+    """Keeps sent messages in memory and optionally appends them to a file"""
+    def __init__(self, path=None, keep=1000):
+        self.path = path
+        self.sent = []
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        record = dict(message, sent_at=utc_timestamp())
+        with self._lock:
+            self.sent.append(record)
+            del self.sent[:-self.keep]
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+
+
+EMAIL_BACKENDS = {
+    "sendgrid": lambda: SendGridTransport(os.getenv("SENDGRID_API_KEY")),
+    "smtp": lambda: SMTPTransport(
+        os.getenv("EMAIL_SMTP_HOST", "localhost"),
+        int(os.getenv("EMAIL_SMTP_PORT", "1025")),
+        username=os.getenv("EMAIL_SMTP_USER"),
+        password=os.getenv("EMAIL_SMTP_PASSWORD"),
+        use_tls=os.getenv("EMAIL_SMTP_TLS", "0") == "1",
+    ),
+    "memory": lambda: RecordingTransport(),
+    "file": lambda: RecordingTransport(os.getenv("EMAIL_RECORD_FILE", os.path.join(INSTANCE_DIR, "sent_emails.jsonl"))),
+}
+
+
+def get_email_transport():
+    """Return this process's transport, building it on first use (and after a fork)"""
+    global _email_transport, _email_transport_pid
+    if _email_transport_pid != os.getpid():
+        with _email_transport_lock:
+            if _email_transport_pid != os.getpid():
+                if EMAIL_BACKEND not in EMAIL_BACKENDS:
+                    raise Exception(f"Unknown EMAIL_BACKEND: {EMAIL_BACKEND}")
+                _email_transport = EMAIL_BACKENDS[EMAIL_BACKEND]()
+                _email_transport_pid = os.getpid()
+    return _email_transport
+
+
+def email_configured():
+    return get_email_transport().missing_configuration() is None
+
+
+# =========================
+# EMAIL OUTBOX
+# =========================
+# Routes never talk to SendGrid directly: they insert into email_outbox in the
+# same transaction as the state change, and a small pool of worker threads per
+# process claims due rows, sends them and retries failures with backoff.
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_RETRY_BASE_SECONDS = int(os.getenv("EMAIL_RETRY_BASE_SECONDS", "30"))
+EMAIL_RETRY_MAX_SECONDS = 3600
+EMAIL_POLL_INTERVAL = float(os.getenv("EMAIL_POLL_INTERVAL", "5"))
+EMAIL_CLAIM_TIMEOUT_SECONDS = 600
+_outbox_wakeup = threading.Event()
+_outbox_workers_pid = None
+_outbox_workers_lock = threading.Lock()
+
+
+def enqueue_email(cursor, to_email, subject, html_content=None, plain_text_content=None,
+                  from_email=None, attachment_path=None, attachment_name=None, attachment_type=None):
+    """Queue an email on the caller's cursor; it is sent only if the caller commits"""
+    cursor.execute("""
+        INSERT INTO email_outbox (to_email, from_email, subject, html_content, plain_text_content,
+                                  attachment_path, attachment_name, attachment_type)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (to_email, from_email, subject, html_content, plain_text_content,
+          attachment_path, attachment_name, attachment_type))
 
-    if not api_key or not sender:
-        raise Exception("Missing SendGrid credentials")
 
-    try:
-        message = Mail(
-            from_email=sender,
-            to_emails=receiver,
-            subject=subject,
-            html_content=content.replace("\n", "<br>")
+def notify_outbox():
+    """Wake the email workers after committing queued messages"""
+    start_email_workers()
+    _outbox_wakeup.set()
+
+
+def _claim_outbox_message(conn):
+    stale_before = utc_timestamp(datetime.now(timezone.utc) - timedelta(seconds=EMAIL_CLAIM_TIMEOUT_SECONDS))
+    cursor = dict_cursor(conn)
+    cursor.execute("""
+        UPDATE email_outbox
+        SET status = 'sending', attempts = attempts + 1, locked_at = CURRENT_TIMESTAMP
+        WHERE id = (
+            SELECT id FROM email_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP)
+               OR (status = 'sending' AND locked_at <= ?)
+            ORDER BY next_attempt_at, id
+            LIMIT 1
         )
+        RETURNING *
+    """, (stale_before,))
+    row = cursor.fetchone()
+    conn.commit()
+    return row
 
-        ssl_context = ssl.create_default_context(cafile=certifi.where())
-        sg = SendGridAPIClient(api_key)
-        #, ssl_context=ssl_context)
-        sg.send(message)
-        print("SENDGRID_API_KEY exists:", bool(os.getenv("SENDGRID_API_KEY")))
-        print("ADMIN_EMAIL:", os.getenv("ADMIN_EMAIL"))
 
+def deliver_outbox_message(message):
+    email = {key: message[key] for key in ("to_email", "subject", "html_content", "plain_text_content",
+                                           "attachment_path", "attachment_name", "attachment_type")}
+    email["from_email"] = message["from_email"] or default_sender()
+    get_email_transport().send(email)
+
+
+def process_outbox_message(conn):
+    """Claim and send one due message; returns False when nothing is due"""
+    message = _claim_outbox_message(conn)
+    if message is None:
+        return False
+    started = time.perf_counter()
+    try:
+        deliver_outbox_message(message)
     except Exception as e:
-        raise Exception(f"Failed to send email via SendGrid: {str(e)}")
+        metrics.EMAIL_SEND_TIME.labels(EMAIL_BACKEND, "error").observe(time.perf_counter() - started)
+        attempts = message["attempts"]
+        if attempts >= EMAIL_MAX_ATTEMPTS:
+            status, delay = "failed", 0
+            app.logger.error("Giving up on email %s to %s: %s", message["id"], message["to_email"], e)
+        else:
+            status = "pending"
+            delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+            app.logger.warning("Email %s to %s failed (attempt %s), retrying in %ss: %s",
+                               message["id"], message["to_email"], attempts, delay, e)
+        conn.execute("""
+            UPDATE email_outbox
+            SET status = ?, last_error = ?, locked_at = NULL,
+                next_attempt_at = datetime(CURRENT_TIMESTAMP, ?)
+            WHERE id = ?
+        """, (status, str(e)[:1000], f"+{delay} seconds", message["id"]))
+    else:
+        metrics.EMAIL_SEND_TIME.labels(EMAIL_BACKEND, "sent").observe(time.perf_counter() - started)
+        conn.execute("""
+            UPDATE email_outbox
+            SET status = 'sent', sent_at = CURRENT_TIMESTAMP, locked_at = NULL, last_error = NULL
+            WHERE id = ?
+        """, (message["id"],))
+    conn.commit()
+    return True
+
+
+def drain_outbox(conn, limit=None):
+    """Send every message that is currently due; returns how many were processed"""
+    processed = 0
+    while limit is None or processed < limit:
+        if not process_outbox_message(conn):
+            break
+        processed += 1
+    return processed
+
+
+def _email_worker_loop():
+    conn = connect_db()
+    while True:
+        try:
+            if drain_outbox(conn, limit=50):
+                continue
+        except Exception as e:
+            app.logger.error("Email worker error: %s", e)
+            if conn.in_transaction:
+                conn.rollback()
+        _outbox_wakeup.wait(EMAIL_POLL_INTERVAL)
+        _outbox_wakeup.clear()
+
+
+def start_email_workers():
+    """Start this process's email worker threads once (after any fork)"""
+    global _outbox_workers_pid
+    if EMAIL_WORKERS <= 0 or _outbox_workers_pid == os.getpid():
+        return
+    with _outbox_workers_lock:
+        if _outbox_workers_pid == os.getpid():
+            return
+        for i in range(EMAIL_WORKERS):
+            threading.Thread(target=_email_worker_loop, name=f"email-worker-{i}", daemon=True).start()
+        _outbox_workers_pid = os.getpid()
+
+
+@app.before_request
+def ensure_email_workers():
+    start_email_workers()
+
+
+@app.cli.command("outbox-drain")
+def outbox_drain_command():
+    """Send all due emails from the outbox and exit"""
+    conn = connect_db()
+    try:
+        print("Processed", drain_outbox(conn), "queued email(s)")
+    finally:
+        conn.close()
+
+
+def send_email(receiver, content, subject="Elfit Arabia Login OTP"):
+    reason = get_email_transport().missing_configuration()
+    if reason:
+        raise Exception(reason)
+
+    conn = get_db()
+    enqueue_email(conn.cursor(), receiver, subject,
+                  html_content=content.replace("\n", "<br>"), from_email=default_sender())
+    conn.commit()
+    notify_outbox()
 
 
 def send_otp_email(receiver, otp):
@@ -346,76 +1556,728 @@ def send_access_denied_email(receiver):
     send_email(receiver, content, "Elfit Arabia - Access Denied")
 
 
-@app.route("/admin/manage-products")
-def manage_products():
-    if not session.get("authenticated"):
-        flash("Please login to access the admin panel")
+# =========================
+# UPLOAD STORE
+# =========================
+# Uploads are stored once under <sha256><ext>, so identical files share one
+# copy and a name can never collide. stored_files.ref_count is kept by
+# triggers on products.image_filename and messages.attachment_name; files
+# whose count drops to zero are removed by collect_unreferenced_files().
+# Because the content never changes under a name, browsers may cache them
+# for good. Names starting with ATTACHMENT_PREFIX live in ATTACHMENT_FOLDER,
+# everything else in the public UPLOAD_FOLDER.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+CONTENT_HASH_NAME = re.compile(r"^[0-9a-f]{64}(-\d+)?\.[a-z0-9]+$")
+ATTACHMENT_PREFIX = "attachments/"
+# mkstemp creates files 0600; public uploads get the mode a plain open()
+# would have given them, so a front-end server running as another user can
+# still read static/. Read once at import, since os.umask() can only be set.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+PUBLIC_FILE_MODE = 0o644 & ~_UMASK
+
+
+def stored_file_path(filename):
+    if filename.startswith(ATTACHMENT_PREFIX):
+        return os.path.join(ATTACHMENT_FOLDER, filename[len(ATTACHMENT_PREFIX):])
+    return os.path.join(UPLOAD_FOLDER, filename)
+
+
+def store_upload(cursor, upload, prefix=""):
+    """Save a werkzeug upload under its content hash; returns the stored filename.
+
+    The upload is copied and hashed in UPLOAD_CHUNK_SIZE pieces, so its size
+    never matters for memory. Call it on the cursor of the transaction that
+    will reference the file: the stored_files row takes the database write
+    lock before the file is moved into place, so collect_unreferenced_files()
+    can never remove it in between.
+    """
+    ext = os.path.splitext(secure_filename(upload.filename))[1].lower()
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(stored_file_path(prefix)), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: upload.stream.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        filename = f"{prefix}{digest.hexdigest()}{ext}"
+        cursor.execute("""
+            INSERT INTO stored_files (filename, sha256, size, content_type)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(filename) DO NOTHING
+        """, (filename, digest.hexdigest(), size, upload.content_type))
+        final_path = stored_file_path(filename)
+        if os.path.exists(final_path):
+            os.remove(temp_path)
+        else:
+            if not filename.startswith(ATTACHMENT_PREFIX):
+                os.chmod(temp_path, PUBLIC_FILE_MODE)
+            os.replace(temp_path, final_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return filename
+
+
+def known_image_variants(cursor, filename):
+    """Variants already built for this stored image by another product, if any"""
+    cursor.execute("""
+        SELECT image_variants FROM products
+        WHERE image_filename = ? AND image_variants IS NOT NULL
+        LIMIT 1
+    """, (filename,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def collect_unreferenced_files(conn=None):
+    """Delete stored files nothing references any more; returns their names"""
+    conn = conn or get_db()
+    if conn.in_transaction:
+        conn.commit()
+    try:
+        # The DELETE holds the write lock until commit, so no upload can
+        # re-reference a file between removing its row and unlinking it
+        removed = [row[0] for row in conn.execute(
+            "DELETE FROM stored_files WHERE ref_count <= 0 RETURNING filename").fetchall()]
+        for filename in removed:
+            if filename.startswith(ATTACHMENT_PREFIX):
+                if os.path.exists(stored_file_path(filename)):
+                    os.remove(stored_file_path(filename))
+            else:
+                remove_image_files(filename)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return removed
+
+
+@app.after_request
+def cache_content_addressed_files(response):
+    if (request.endpoint == "static" and response.status_code in (200, 304)
+            and CONTENT_HASH_NAME.match(os.path.basename(request.view_args.get("filename", "")))):
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+@app.template_filter("attachment_url")
+def attachment_url(filename):
+    """URL of a message attachment, private or legacy static"""
+    if filename.startswith(ATTACHMENT_PREFIX):
+        return url_for("message_attachment", filename=filename[len(ATTACHMENT_PREFIX):])
+    return url_for("static", filename="uploads/products/" + filename)
+
+
+@app.route("/attachments/<filename>")
+def message_attachment(filename):
+    user_email = session.get("user_email")
+    if not session.get("authenticated") or not user_email:
         return redirect(url_for("login"))
-    if not session.get("is_admin") or not is_admin_in_db(session.get("user_email")):
-        flash("Admin access required")
-        return redirect(url_for("dashboard"))
+    if not is_admin_in_db(user_email):
+        owner = get_db().execute("""
+            SELECT 1 FROM messages WHERE attachment_name = ? AND user_email = ? LIMIT 1
+        """, (ATTACHMENT_PREFIX + filename, user_email)).fetchone()
+        if owner is None:
+            return "Not found", 404
+    response = send_from_directory(ATTACHMENT_FOLDER, filename)
+    response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
+
+
+@app.cli.command("uploads-dedupe")
+def uploads_dedupe_command():
+    """Move legacy uploads to content-hash names and drop duplicate copies"""
+    conn = connect_db()
+    try:
+        legacy = [row[0] for row in conn.execute(
+            "SELECT filename FROM stored_files WHERE sha256 IS NULL").fetchall()]
+        moved = 0
+        for old_name in legacy:
+            old_path = os.path.join(UPLOAD_FOLDER, old_name)
+            if not os.path.isfile(old_path):
+                continue
+            digest = hashlib.sha256()
+            with open(old_path, "rb") as f:
+                for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            new_name = f"{digest.hexdigest()}{os.path.splitext(old_name)[1].lower()}"
+            conn.execute("""
+                INSERT INTO stored_files (filename, sha256, size)
+                VALUES (?, ?, ?)
+                ON CONFLICT(filename) DO NOTHING
+            """, (new_name, digest.hexdigest(), os.path.getsize(old_path)))
+            new_path = os.path.join(UPLOAD_FOLDER, new_name)
+            if not os.path.exists(new_path):
+                try:
+                    os.link(old_path, new_path)
+                except OSError:
+                    shutil.copy2(old_path, new_path)
+            # Variants were named after the old file; images-rebuild redoes them
+            conn.execute("UPDATE products SET image_filename = ?, image_variants = NULL WHERE image_filename = ?",
+                         (new_name, old_name))
+            conn.execute("UPDATE messages SET attachment_name = ? WHERE attachment_name = ?", (new_name, old_name))
+            conn.execute("UPDATE email_outbox SET attachment_path = ? WHERE attachment_path = ?", (new_path, old_path))
+            conn.commit()
+            moved += 1
+        removed = collect_unreferenced_files(conn)
+        print(f"Renamed {moved} legacy upload(s), removed {len(removed)} unreferenced file(s)")
+        if moved:
+            print("Run `flask images-rebuild` to rebuild their image variants")
+    finally:
+        conn.close()
 
-    all_categories = [
-        "Winches", "Cable Drum Trailers", "Rollers", "Cable Drum Lifting Jacks", "Cable Locators", "Reeling Machine",
-        "Cable Pulling Grips & Swivel Link", "Duct Rods", "Hydraulic Cutting and Crimping Tools"
-        ,"Warning Tapes", "Manhole", "Ropes", "Duct",
-        "Electrical", "Solar", "Pipes", "Optical Fibre Cables",
-        "Optical Fiber Connectors","Optical Fiber Adapters", "Optical Fiber Consumable",
-        "Optical Fiber Instruments", "Optical Distribution Frames", "Optical Fiber Patch Cord",
-        "Optical Fibre Tools", "Cabinets","Cable Joint Products","Cable & Wires","Connectors",
-        "Distribution Boxes", "Ducts Accessories","Manhole Accessories","Marking & Protection","Earthing Hardware",
-        "Miscellaneous","Poles & Accessories" , "Tapes", "Terminal Blocks","Test & Measurement",
-                                                                           "Telecom Tools" ,"Other Products"
-    ]
-    # Connect to database
-    conn = sqlite3.connect(DATABASE)
+
+# =========================
+# IMAGE VARIANTS
+# =========================
+# Uploads are resized into WebP/AVIF copies by a small process pool so the
+# request thread never decodes an image. products.image_variants records what
+# exists ({"webp": [320, 640], ...}); until it is set, pages use the original.
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+VARIANTS_FOLDER = os.path.join(UPLOAD_FOLDER, "variants")
+_image_pool = None
+_image_pool_pid = None
+_image_pool_lock = threading.Lock()
+
+
+def new_image_pool():
+    # spawn: children import only image_variants, never this app
+    return ProcessPoolExecutor(max_workers=max(IMAGE_WORKERS, 1),
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+def get_image_pool():
+    """This process's image pool, created on first use (and after a fork)"""
+    global _image_pool, _image_pool_pid
+    if _image_pool_pid != os.getpid():
+        with _image_pool_lock:
+            if _image_pool_pid != os.getpid():
+                _image_pool = new_image_pool()
+                _image_pool_pid = os.getpid()
+    return _image_pool
+
+
+def record_image_variants(product_id, image_filename, variants):
+    conn = connect_db()
+    try:
+        # Skip if the product's image was replaced while this one was processing
+        conn.execute("UPDATE products SET image_variants = ? WHERE id = ? AND image_filename = ?",
+                     (json.dumps(variants) if variants else None, product_id, image_filename))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _on_image_variants_done(product_id, image_filename, future):
+    try:
+        variants = future.result()
+    except Exception as e:
+        app.logger.error("Could not build variants of %s: %s", image_filename, e)
+        return
+    record_image_variants(product_id, image_filename, variants)
+
+
+def schedule_image_variants(product_id, image_filename):
+    """Build variants of a saved upload in the background; returns the future or None.
+
+    Called after the product is committed, so a pool that cannot take the job
+    is logged rather than raised; `flask images-rebuild` fills the gap later.
+    """
+    if IMAGE_WORKERS <= 0 or not image_variants.available_formats():
+        return None
+    try:
+        future = get_image_pool().submit(image_variants.generate_variants,
+                                         os.path.join(UPLOAD_FOLDER, image_filename), VARIANTS_FOLDER)
+    except Exception as e:
+        app.logger.error("Could not schedule variants of %s: %s", image_filename, e)
+        return None
+    future.add_done_callback(lambda f: _on_image_variants_done(product_id, image_filename, f))
+    return future
+
+
+def remove_image_files(image_filename):
+    """Delete an upload and its variants"""
+    file_path = os.path.join(UPLOAD_FOLDER, image_filename)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    image_variants.remove_variants(image_filename, VARIANTS_FOLDER)
+
+
+@app.cli.command("images-rebuild")
+@click.option("--all", "rebuild_all", is_flag=True, help="Rebuild variants that already exist too")
+def images_rebuild_command(rebuild_all):
+    """Build missing image variants for every product"""
+    if not image_variants.available_formats():
+        print("Pillow with WebP/AVIF support is not installed; nothing to do")
+        return
+    conn = connect_db()
+    try:
+        rows = conn.execute("""
+            SELECT id, image_filename FROM products
+            WHERE image_filename IS NOT NULL AND image_filename != '' AND (? OR image_variants IS NULL)
+        """, (rebuild_all,)).fetchall()
+    finally:
+        conn.close()
+    with new_image_pool() as pool:
+        jobs = {}
+        for product_id, image_filename in rows:
+            source = os.path.join(UPLOAD_FOLDER, image_filename)
+            if os.path.isfile(source):
+                jobs[pool.submit(image_variants.generate_variants, source, VARIANTS_FOLDER)] = (product_id, image_filename)
+        for done, future in enumerate(jobs, 1):
+            product_id, image_filename = jobs[future]
+            try:
+                record_image_variants(product_id, image_filename, future.result())
+            except Exception as e:
+                print(f"  {image_filename}: {e}")
+            print(f"\r{done}/{len(jobs)} images", end="", flush=True)
+    print()
+
+
+# =========================
+# CATALOGUE CACHE
+# =========================
+# The catalogue only changes through product and category writes, and their
+# triggers bump the data versions, so each worker keeps the parsed products
+# and both grouped views until either version moves.
+_catalogue_cache = (None, None)
+
+
+def _load_json_field(raw):
+    try:
+        return json.loads(raw) if raw else {}
+    except json.JSONDecodeError:
+        return {}
+
+
+def load_categories(conn):
+    """Registered category names in display order, FALLBACK_CATEGORY last"""
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM categories ORDER BY key = ?, position, id", (category_key(FALLBACK_CATEGORY),))]
+    if FALLBACK_CATEGORY not in names:
+        names.append(FALLBACK_CATEGORY)
+    return names
+
+
+def build_catalogue(conn):
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products ORDER BY category, product_name")
-    products_raw = cursor.fetchall()
-    conn.close()
-    # Convert products to dictionaries
-    products_list = []
-    for p in products_raw:
-        try:
-            options = json.loads(p[3]) if p[3] else {}
-        except json.JSONDecodeError:
-            options = {}
-        products_list.append({
+    cursor.execute("SELECT * FROM products ORDER BY id")
+    rows = [(row, _load_json_field(row[3]), _load_json_field(row[9]))
+            for row in cursor.fetchall()]
+    categories = load_categories(conn)
+    category_lookup = {category_key(name): name for name in categories}
+
+    def group_of(product_category):
+        return category_lookup.get(category_key(product_category), FALLBACK_CATEGORY)
+
+    # Admin view: sorted by category and name
+    products_by_category = {category: [] for category in categories}
+    for p, options, variants in sorted(rows, key=lambda item: (item[0][2], item[0][1])):
+        products_by_category[group_of(p[2])].append({
             "id": p[0],
             "name": p[1],
             "category": p[2],
             "options": options,
             "rate": p[4] if p[4] else None,
             "stock": p[5] if p[5] else "out_of_stock",
-            "image": p[6] if p[6] else None
+            "image": p[6] if p[6] else None,
+            "variants": variants
         })
-    products_by_category = {category: [] for category in all_categories}
-    for product in products_list:
-        matched = False
-        for cat in all_categories:
-            if product["category"].lower().strip() == cat.lower().strip():
-                products_by_category[cat].append(product)
-                matched = True
-                break
-        if not matched:
-            products_by_category["Other Products"].append(product)
-    for product in products_list:
-        print(f'products_list: {product}')
+
+    # Client dashboard: insertion order
+    products_by_cat = {category: [] for category in categories}
+    for row, options, variants in rows:
+        products_by_cat[group_of(row[2])].append({
+            "id": row[0],
+            "name": row[1],
+            "category": row[2],
+            "options": options,
+            "rate": row[4],
+            "stock": row[5],
+            "image": row[6],
+            "variants": variants
+        })
+    return {"categories": categories, "products_by_category": products_by_category,
+            "products_by_cat": products_by_cat}
+
+
+def get_catalogue():
+    """Grouped catalogue views for this worker, rebuilt when products or categories change"""
+    global _catalogue_cache
+    # Read the version first: a write landing mid-build only causes one extra rebuild
+    version = get_data_versions("products", "categories")
+    cached_version, catalogue = _catalogue_cache
+    if cached_version == version:
+        return catalogue
+    catalogue = build_catalogue(get_db())
+    _catalogue_cache = (version, catalogue)
+    return catalogue
+
+
+def render_catalogue_fragment(catalogue, template_name, **context):
+    """Render a catalogue-only template once per catalogue version.
+
+    The fragment lives in the catalogue dict, so it is dropped with it. Only
+    pass context that is the same for every user.
+    """
+    fragments = catalogue.setdefault("fragments", {})
+    fragment = fragments.get(template_name)
+    if fragment is None:
+        fragment = Markup(render_template(template_name, **context))
+        fragments[template_name] = fragment
+    return fragment
+
+
+# =========================
+# CATALOGUE IMPORT/EXPORT
+# =========================
+# `flask catalogue import FILE` loads records shaped like product_data.json
+# ({"id", "name", "category", "options", "rate", "stock", "image"}) from JSON
+# or CSV, and `flask catalogue export` writes the same shape. Records match
+# existing products by id (or, without one, by exact category and name); only
+# rows that differ are written, in batched upserts inside one transaction, so
+# running the same import twice changes nothing the second time.
+CATALOGUE_FIELDS = ("id", "name", "category", "options", "rate", "stock", "image")
+CATALOGUE_BATCH_SIZE = 500
+STOCK_STATUSES = ("in_stock", "out_of_stock")
+
+
+def catalogue_file_format(filename, fmt=None):
+    if fmt:
+        return fmt
+    return "csv" if filename.lower().endswith(".csv") else "json"
+
+
+def read_catalogue_records(stream, fmt):
+    """Product records from a JSON array or a CSV with CATALOGUE_FIELDS columns"""
+    if fmt == "csv":
+        # options is a JSON object in its own column; blank cells mean "not given"
+        for row in csv.DictReader(stream):
+            yield {field: value for field, value in row.items() if value not in (None, "")}
+        return
+    records = json.load(stream)
+    if not isinstance(records, list):
+        raise ValueError("a JSON catalogue must be a list of products")
+    yield from records
+
+
+def normalize_catalogue_record(record):
+    """Validate one record; returns (id, name, category, options, rate, stock, image)"""
+    if not isinstance(record, dict):
+        raise ValueError("not an object")
+    product_id = record.get("id")
+    product_id = int(product_id) if product_id not in (None, "") else None
+    name = record.get("name")
+    category = record.get("category")
+    if not isinstance(name, str) or not name.strip() or not isinstance(category, str) or not category.strip():
+        raise ValueError("name and category are required")
+    options = record.get("options")
+    if isinstance(options, str):
+        options = json.loads(options)
+    options = options or {}
+    if not isinstance(options, dict):
+        raise ValueError("options must be an object")
+    stock = record.get("stock") or "in_stock"
+    if stock not in STOCK_STATUSES:
+        raise ValueError(f"stock must be one of {', '.join(STOCK_STATUSES)}")
+    return product_id, name, category, options, record.get("rate") or "", stock, record.get("image") or ""
+
+
+def plan_catalogue_import(conn, records):
+    """Diff records against the products table.
+
+    Returns (changes, inserted, updated, unchanged, errors) where changes are
+    upsert parameter tuples. A record without an image keeps the current one.
+    """
+    existing = {}
+    by_name = {}
+    for row in conn.execute("""
+        SELECT id, product_name, category, product_options, product_rate, stock_status, image_filename
+        FROM products ORDER BY id
+    """):
+        existing[row[0]] = row
+        by_name.setdefault((row[2], row[1]), row[0])
+
+    changes, errors = [], []
+    inserted = updated = unchanged = 0
+    seen = set()
+    for number, record in enumerate(records, 1):
+        try:
+            product_id, name, category, options, rate, stock, image = normalize_catalogue_record(record)
+        except (ValueError, TypeError) as e:
+            errors.append(f"record {number}: {e}")
+            continue
+        if product_id is None:
+            product_id = by_name.get((category, name))
+        key = product_id if product_id is not None else (category, name)
+        if key in seen:
+            errors.append(f"record {number}: product {product_id or name!r} appears more than once")
+            continue
+        seen.add(key)
+        current = existing.get(product_id)
+        if current is not None:
+            image = image or current[6] or ""
+            if (current[1], current[2], _load_json_field(current[3]) or {}, current[4] or "", current[5], current[6] or "") \
+                    == (name, category, options, rate, stock, image):
+                unchanged += 1
+                continue
+            updated += 1
+        else:
+            inserted += 1
+        changes.append((product_id, name, category, json.dumps(options), rate, stock, image))
+    return changes, inserted, updated, unchanged, errors
+
+
+def apply_catalogue_changes(conn, changes, progress=None):
+    """Upsert planned rows in CATALOGUE_BATCH_SIZE batches; the caller commits"""
+    for start in range(0, len(changes), CATALOGUE_BATCH_SIZE):
+        batch = changes[start:start + CATALOGUE_BATCH_SIZE]
+        conn.executemany("""
+            INSERT INTO products (id, product_name, category, product_options, product_rate,
+                                  stock_status, image_filename)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                product_name = excluded.product_name,
+                category = excluded.category,
+                product_options = excluded.product_options,
+                product_rate = excluded.product_rate,
+                stock_status = excluded.stock_status,
+                image_variants = CASE WHEN image_filename IS excluded.image_filename
+                                      THEN image_variants END,
+                image_filename = excluded.image_filename,
+                updated_at = CURRENT_TIMESTAMP
+        """, batch)
+        if progress:
+            progress(start + len(batch), len(changes))
+
+
+def import_catalogue(records, dry_run=False, progress=None):
+    """Diff and apply records in one transaction; returns the plan's counts"""
+    conn = connect_db()
+    try:
+        # Taken before diffing so nothing can change between the diff and the write
+        conn.execute("BEGIN IMMEDIATE")
+        changes, inserted, updated, unchanged, errors = plan_catalogue_import(conn, records)
+        if errors or dry_run:
+            conn.rollback()
+        else:
+            apply_catalogue_changes(conn, changes, progress)
+            conn.commit()
+            # Replaced images may have lost their last reference
+            collect_unreferenced_files(conn)
+        return {"inserted": inserted, "updated": updated, "unchanged": unchanged, "errors": errors}
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def export_catalogue_records(conn, category=None):
+    """Yield every product as a catalogue record, streaming from the cursor"""
+    query = """
+        SELECT id, product_name, category, product_options, product_rate, stock_status, image_filename
+        FROM products
+    """
+    params = ()
+    if category:
+        query += " WHERE category = ?"
+        params = (category,)
+    for row in conn.execute(query + " ORDER BY id", params):
+        yield {
+            "id": row[0],
+            "name": row[1],
+            "category": row[2],
+            "options": _load_json_field(row[3]) or {},
+            "rate": row[4] or "",
+            "stock": row[5],
+            "image": row[6] or "",
+        }
+
+
+@app.cli.group("catalogue")
+def catalogue_command():
+    """Bulk import and export of the product catalogue"""
+
+
+@catalogue_command.command("import")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "fmt", type=click.Choice(["json", "csv"]), help="Defaults to the file extension")
+@click.option("--dry-run", is_flag=True, help="Report what would change without writing")
+def catalogue_import_command(source, fmt, dry_run):
+    """Insert or update products from a JSON or CSV file"""
+    try:
+        records = list(read_catalogue_records(source, catalogue_file_format(source.name, fmt)))
+    except (ValueError, csv.Error) as e:
+        raise click.ClickException(f"Could not read {source.name}: {e}")
+
+    def progress(done, total):
+        print(f"\r{done}/{total} products written", end="", flush=True)
+
+    started = time.perf_counter()
+    result = import_catalogue(records, dry_run=dry_run, progress=progress)
+    if result["inserted"] + result["updated"] and not dry_run and not result["errors"]:
+        print()
+    for error in result["errors"][:20]:
+        print(f"  {error}")
+    if result["errors"]:
+        raise click.ClickException(f"{len(result['errors'])} invalid record(s); nothing was imported")
+    print(f"{'Would insert' if dry_run else 'Inserted'} {result['inserted']}, "
+          f"{'update' if dry_run else 'updated'} {result['updated']}, "
+          f"{result['unchanged']} unchanged ({time.perf_counter() - started:.2f}s)")
+
+
+@catalogue_command.command("export")
+@click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+@click.option("--format", "fmt", type=click.Choice(["json", "csv"]), help="Defaults to the file extension, else JSON")
+@click.option("--category", help="Only export this category")
+def catalogue_export_command(output, fmt, category):
+    """Write the products as JSON or CSV (to stdout by default)"""
+    fmt = catalogue_file_format(output.name, fmt)
+    conn = connect_db()
+    try:
+        records = export_catalogue_records(conn, category)
+        if fmt == "csv":
+            writer = csv.DictWriter(output, fieldnames=CATALOGUE_FIELDS)
+            writer.writeheader()
+            for record in records:
+                writer.writerow(dict(record, options=json.dumps(record["options"])))
+        else:
+            # One record per line, written as it is read
+            output.write("[")
+            for count, record in enumerate(records):
+                output.write(",\n" if count else "\n")
+                output.write(json.dumps(record))
+            output.write("\n]\n")
+    finally:
+        conn.close()
+
+
+@app.route("/admin/manage-products")
+@admin_required
+def manage_products():
+    catalogue = get_catalogue()
     return render_template(
         "admin.html",
         section="manage-products",
-        all_categories=all_categories,
-        products_by_category=products_by_category)
+        all_categories=catalogue["categories"],
+        products_by_category=catalogue["products_by_category"],
+        fallback_category=FALLBACK_CATEGORY)
+
+
+def _products_in_category(cursor, key):
+    """Raw products.category values that normalize to `key`"""
+    return [name for (name,) in cursor.execute("SELECT DISTINCT category FROM products").fetchall()
+            if category_key(name) == key]
+
+
+@app.route("/admin/categories", methods=["GET", "POST"])
+@admin_required
+def manage_categories():
+    conn = get_db()
+    cursor = conn.cursor()
+    if request.method == "POST":
+        name = " ".join(request.form.get("name", "").split())
+        if not name:
+            flash("Please enter a category name")
+        else:
+            try:
+                cursor.execute("""
+                    INSERT INTO categories (name, key, position)
+                    VALUES (?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM categories))
+                """, (name, category_key(name)))
+                conn.commit()
+                flash(f"Category '{name}' added")
+            except sqlite3.IntegrityError:
+                conn.rollback()
+                flash(f"A category named '{name}' already exists")
+        return redirect(url_for("manage_categories"))
+
+    catalogue = get_catalogue()
+    categories = dict_cursor(conn).execute("""
+        SELECT id, name, key FROM categories ORDER BY key = ?, position, id
+    """, (category_key(FALLBACK_CATEGORY),)).fetchall()
+    product_counts = {name: len(products) for name, products in catalogue["products_by_category"].items()}
+    return render_template("admin.html", section="manage-categories", categories=categories,
+                           product_counts=product_counts, fallback_category=FALLBACK_CATEGORY)
+
+
+@app.route("/admin/categories/<int:category_id>/rename", methods=["POST"])
+@admin_required
+def rename_category(category_id):
+    conn = get_db()
+    cursor = conn.cursor()
+    row = cursor.execute("SELECT name, key FROM categories WHERE id = ?", (category_id,)).fetchone()
+    new_name = " ".join(request.form.get("name", "").split())
+    if not row:
+        flash("Category not found")
+    elif row[1] == category_key(FALLBACK_CATEGORY):
+        flash(f"'{FALLBACK_CATEGORY}' cannot be renamed")
+    elif not new_name:
+        flash("Please enter a category name")
+    elif new_name != row[0]:
+        try:
+            cursor.execute("UPDATE categories SET name = ?, key = ? WHERE id = ?",
+                           (new_name, category_key(new_name), category_id))
+            # Products follow the rename in the same transaction
+            old_names = _products_in_category(cursor, row[1])
+            cursor.executemany("UPDATE products SET category = ?, updated_at = CURRENT_TIMESTAMP WHERE category = ?",
+                               [(new_name, old_name) for old_name in old_names])
+            conn.commit()
+            flash(f"Category '{row[0]}' renamed to '{new_name}'")
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            flash(f"A category named '{new_name}' already exists")
+    return redirect(url_for("manage_categories"))
+
+
+@app.route("/admin/categories/<int:category_id>/move", methods=["POST"])
+@admin_required
+def move_category(category_id):
+    """Swap a category with its neighbour above or below"""
+    conn = get_db()
+    cursor = conn.cursor()
+    ordered = [row[0] for row in cursor.execute("""
+        SELECT id FROM categories WHERE key != ? ORDER BY position, id
+    """, (category_key(FALLBACK_CATEGORY),)).fetchall()]
+    if category_id in ordered:
+        index = ordered.index(category_id)
+        other = index - 1 if request.form.get("direction") == "up" else index + 1
+        if 0 <= other < len(ordered):
+            ordered[index], ordered[other] = ordered[other], ordered[index]
+            # Renumbering keeps positions dense, whatever earlier edits left behind
+            cursor.executemany("UPDATE categories SET position = ? WHERE id = ? AND position != ?",
+                               [(position, cid, position) for position, cid in enumerate(ordered, 1)])
+            conn.commit()
+    return redirect(url_for("manage_categories"))
+
+
+@app.route("/admin/categories/<int:category_id>/delete", methods=["POST"])
+@admin_required
+def delete_category(category_id):
+    conn = get_db()
+    cursor = conn.cursor()
+    row = cursor.execute("SELECT name, key FROM categories WHERE id = ?", (category_id,)).fetchone()
+    if not row:
+        flash("Category not found")
+    elif row[1] == category_key(FALLBACK_CATEGORY):
+        flash(f"'{FALLBACK_CATEGORY}' cannot be deleted")
+    elif _products_in_category(cursor, row[1]):
+        flash(f"Category '{row[0]}' still has products; move or delete them first")
+    else:
+        cursor.execute("DELETE FROM categories WHERE id = ?", (category_id,))
+        conn.commit()
+        flash(f"Category '{row[0]}' deleted")
+    return redirect(url_for("manage_categories"))
 
 
 @app.route("/admin/add-product", methods=['GET', 'POST'])
+@admin_required
 def add_product():
-    if not session.get("authenticated"):
-        flash("Please login to access the admin panel")
-        return redirect(url_for("login"))
-    if not session.get("is_admin") or not is_admin_in_db(session.get("user_email")):
-        flash("Admin access required")
-        return redirect(url_for("dashboard"))
     if request.method == 'POST':
         try:
             product_name = request.form.get('product_name')
@@ -431,30 +2293,30 @@ def add_product():
 
             options_json = json.dumps(options if options else None)
 
+            conn = get_db()
+            cursor = conn.cursor()
             image_filename = None
+            image_variants_json = None
             if 'product_image' in request.files:
                 file = request.files['product_image']
                 if file and file.filename != '' and allowed_file(file.filename):
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = secure_filename(file.filename)
-                    name, ext = os.path.splitext(filename)
-                    image_filename = f"{timestamp}_{name}{ext}"
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-                    file.save(file_path)
-
-            conn = sqlite3.connect(app.config['DATABASE'])
-            cursor = conn.cursor()
+                    image_filename = store_upload(cursor, file)
+                    image_variants_json = known_image_variants(cursor, image_filename)
+
             cursor.execute("""
-                INSERT INTO products (product_name, category, product_options, product_rate, stock_status, image_filename)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (product_name, category, options_json, product_rate, stock_status, image_filename))
+                INSERT INTO products (product_name, category, product_options, product_rate, stock_status,
+                                      image_filename, image_variants)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (product_name, category, options_json, product_rate, stock_status, image_filename, image_variants_json))
             conn.commit()
-            conn.close()
+            if image_filename and not image_variants_json:
+                schedule_image_variants(cursor.lastrowid, image_filename)
 
             flash(f"Product '{product_name}' added successfully to {category} category!")
             return redirect(url_for("manage_products"))
 
         except Exception as e:
+            get_db().rollback()
             flash(f"Error adding product: {str(e)}")
             return redirect(url_for("manage_products"))
 
@@ -462,15 +2324,9 @@ def add_product():
 
 
 @app.route("/admin/edit-product/<int:product_id>", methods=['GET', 'POST'])
+@admin_required
 def edit_product(product_id):
-    if not session.get("authenticated"):
-        flash("Please login to access the admin panel")
-        return redirect(url_for("login"))
-    if not session.get("is_admin") or not is_admin_in_db(session.get("user_email")):
-        flash("Admin access required")
-        return redirect(url_for("dashboard"))
-
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
 
     if request.method == 'POST':
@@ -491,29 +2347,23 @@ def edit_product(product_id):
             options_json = json.dumps(options) if options else None
 
             image_filename = None
+            image_variants_json = None
             if 'product_image' in request.files:
                 file = request.files['product_image']
                 if file and file.filename != '' and allowed_file(file.filename):
-                    cursor.execute("SELECT image_filename FROM products WHERE id = ?", (product_id,))
-                    old_image = cursor.fetchone()
-                    if old_image and old_image[0]:
-                        old_file_path = os.path.join(app.config['UPLOAD_FOLDER'], old_image[0])
-                        if os.path.exists(old_file_path):
-                            os.remove(old_file_path)
-
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = secure_filename(file.filename)
-                    name, ext = os.path.splitext(filename)
-                    image_filename = f"{timestamp}_{name}{ext}"
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-                    file.save(file_path)
+                    # The old image is released by the reference triggers and
+                    # removed below once no other product or message uses it
+                    image_filename = store_upload(cursor, file)
+                    image_variants_json = known_image_variants(cursor, image_filename)
 
                     cursor.execute("""
                         UPDATE products 
                         SET product_name = ?, category = ?, product_options = ?, 
-                            product_rate = ?, stock_status = ?, image_filename = ?, updated_at = CURRENT_TIMESTAMP
+                            product_rate = ?, stock_status = ?, image_filename = ?, image_variants = ?,
+                            updated_at = CURRENT_TIMESTAMP
                         WHERE id = ?
-                    """, (product_name, category, options_json, product_rate, stock_status, image_filename, product_id))
+                    """, (product_name, category, options_json, product_rate, stock_status, image_filename,
+                          image_variants_json, product_id))
                 else:
                     cursor.execute("""
                         UPDATE products 
@@ -530,19 +2380,21 @@ def edit_product(product_id):
                 """, (product_name, category, options_json, product_rate, stock_status, product_id))
 
             conn.commit()
-            conn.close()
+            if image_filename:
+                collect_unreferenced_files(conn)
+                if not image_variants_json:
+                    schedule_image_variants(product_id, image_filename)
 
             flash(f"Product '{product_name}' updated successfully!")
             return redirect(url_for("manage_products"))
 
         except Exception as e:
+            conn.rollback()
             flash(f"Error updating product: {str(e)}")
-            conn.close()
             return redirect(url_for("manage_products"))
 
     cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
     product = cursor.fetchone()
-    conn.close()
 
     if not product:
         flash("Product not found")
@@ -557,43 +2409,237 @@ def edit_product(product_id):
 
 
 @app.route("/admin/delete-product/<int:product_id>", methods=['POST'])
+@admin_required
 def delete_product(product_id):
-    if not session.get("authenticated"):
-        flash("Please login to access the admin panel")
-        return redirect(url_for("login"))
-    if not session.get("is_admin") or not is_admin_in_db(session.get("user_email")):
-        flash("Admin access required")
-        return redirect(url_for("dashboard"))
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cursor = conn.cursor()
         cursor.execute("SELECT product_name, image_filename FROM products WHERE id = ?", (product_id,))
         product = cursor.fetchone()
         if product:
             product_name = product[0]
             image_filename = product[1]
-            if image_filename:
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
             cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
             conn.commit()
+            if image_filename:
+                collect_unreferenced_files(conn)
             flash(f"Product '{product_name}' deleted successfully!")
         else:
             flash("Product not found")
-        conn.close()
     except Exception as e:
         flash(f"Error deleting product: {str(e)}")
     return redirect(url_for("manage_products"))
 
+# Free-text search over name, category and option keys/values. Every word
+# must prefix-match somewhere; bm25 weights a hit in the name above one in
+# the category, and both above one in the options.
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_RESULTS = 500
+SEARCH_MAX_TERMS = 8
+SEARCH_WEIGHTS = (10.0, 2.0, 1.0)
+SEARCH_TERM = re.compile(r"\w+")
+
+
+def fts_query(text):
+    """FTS5 MATCH expression for user input, or "" when it has no words"""
+    terms = SEARCH_TERM.findall(text.lower())[:SEARCH_MAX_TERMS]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def highlight_snippet(snippet):
+    """Escape a snippet() result and turn its \\x02/\\x03 markers into <mark>"""
+    return str(escape(snippet)).replace("\x02", "<mark>").replace("\x03", "</mark>")
+
+
+@app.route("/api/products/search")
+@login_required
+@conditional_json("products")
+def search_products():
+    """Ranked product search; `snippet` is HTML with the matches in <mark>"""
+    query = fts_query(request.args.get("q", ""))
+    if not query:
+        return jsonify([])
+    try:
+        limit = min(max(int(request.args.get("limit", SEARCH_PAGE_SIZE)), 1), SEARCH_MAX_RESULTS)
+    except ValueError:
+        limit = SEARCH_PAGE_SIZE
+    where = ""
+    # Ordering by the rank column lets FTS5 hand rows back already sorted
+    params = [query, f"bm25({', '.join(map(str, SEARCH_WEIGHTS))})"]
+    category = request.args.get("category")
+    if category:
+        where = "AND p.category = ?"
+        params.append(category)
+    rows = dict_cursor(get_db()).execute(f"""
+        SELECT p.id, p.product_name, p.category, p.stock_status, p.image_filename,
+               snippet(products_fts, -1, char(2), char(3), '…', 12) AS snippet,
+               products_fts.rank AS score
+        FROM products_fts
+        JOIN products p ON p.id = products_fts.rowid
+        WHERE products_fts MATCH ? AND products_fts.rank MATCH ? {where}
+        ORDER BY products_fts.rank
+        LIMIT ?
+    """, (*params, limit)).fetchall()
+    results = []
+    for row in rows:
+        result = dict(row)
+        result["snippet"] = highlight_snippet(row["snippet"])
+        results.append(result)
+    return jsonify(results)
+
+
+# Faceted browsing over product_attributes. Filters are query args:
+# attr.<key>=<value> (repeatable, any of the values), min.<key>/max.<key> on
+# the value's leading number, and category. Each facet is counted with every
+# filter except its own, so picking a value still shows what its siblings
+# would match.
+FACET_PAGE_SIZE = 50
+FACET_KEY_LIMIT = 20
+FACET_VALUE_LIMIT = 25
+FACET_MAX_VALUE_LENGTH = 60
+
+
+def parse_attribute_filters(args):
+    """{key: {"values", "min", "max"}} from attr./min./max. args; ValueError on a bad number"""
+    filters = {}
+    for arg, raw in args.items(multi=True):
+        prefix, _, key = arg.partition(".")
+        key = key.strip()
+        if prefix not in ("attr", "min", "max") or not key:
+            continue
+        spec = filters.setdefault(key, {"values": [], "min": None, "max": None})
+        if prefix == "attr":
+            spec["values"].append(raw.strip())
+        else:
+            spec[prefix] = float(raw)
+    return filters
+
+
+def _product_filter_sql(category, filters, skip_key=None):
+    """WHERE clause on products p for the category and every filter but skip_key"""
+    clauses, params = ["1"], []
+    if category:
+        clauses.append("p.category = ?")
+        params.append(category)
+    for key, spec in filters.items():
+        if key == skip_key:
+            continue
+        conditions = ["key = ?"]
+        params.append(key)
+        if spec["values"]:
+            conditions.append(f"value IN ({', '.join('?' for _ in spec['values'])})")
+            params.extend(spec["values"])
+        if spec["min"] is not None:
+            conditions.append("numeric_value >= ?")
+            params.append(spec["min"])
+        if spec["max"] is not None:
+            conditions.append("numeric_value <= ?")
+            params.append(spec["max"])
+        clauses.append(f"p.id IN (SELECT product_id FROM product_attributes WHERE {' AND '.join(conditions)})")
+    return " AND ".join(clauses), params
+
+
+def _facet_value_counts(cursor, category, filters, skip_key=None, keys=None):
+    where, params = _product_filter_sql(category, filters, skip_key)
+    key_clause = ""
+    if keys:
+        key_clause = f"AND a.key IN ({', '.join('?' for _ in keys)})"
+        params = [*params, *keys]
+    return cursor.execute(f"""
+        SELECT a.key, a.value, MIN(a.numeric_value), COUNT(*)
+        FROM products p
+        JOIN product_attributes a ON a.product_id = p.id
+        WHERE {where} {key_clause}
+        GROUP BY a.key, a.value
+    """, params).fetchall()
+
+
+def _facet_keys(rows):
+    """{key: products sharing a short value with another}; free-text specs score low or not at all"""
+    scores = {}
+    for key, value, _, count in rows:
+        if count >= 2 and len(value) <= FACET_MAX_VALUE_LENGTH:
+            scores[key] = scores.get(key, 0) + count
+    return scores
+
+
+def _build_facets(rows, filters, facet_keys):
+    by_key = {}
+    for key, value, numeric_value, count in rows:
+        if key in filters or (key in facet_keys and len(value) <= FACET_MAX_VALUE_LENGTH):
+            by_key.setdefault(key, []).append((value, numeric_value, count))
+    facets = []
+    for key, values in by_key.items():
+        selected = filters.get(key, {}).get("values", [])
+        numbers = [v[1] for v in values if v[1] is not None]
+        values.sort(key=lambda v: (-v[2], v[0]))
+        facets.append({
+            "key": key,
+            "products": sum(v[2] for v in values),
+            "values": [{"value": value, "count": count, "selected": value in selected}
+                       for value, _, count in values[:FACET_VALUE_LIMIT]],
+            "range": {"min": min(numbers), "max": max(numbers)} if numbers else None,
+        })
+    facets.sort(key=lambda f: (f["key"] not in filters, -facet_keys.get(f["key"], 0), f["key"]))
+    return facets
+
+
+@app.route("/api/products/facets")
+@login_required
+@conditional_json("products")
+def product_facets():
+    """Products matching the attribute filters, plus value counts per facet.
+
+    Pass facet=<key> (repeatable) for specific facets; otherwise the keys
+    with the most shared values are returned.
+    """
+    try:
+        filters = parse_attribute_filters(request.args)
+        limit = min(max(int(request.args.get("limit", FACET_PAGE_SIZE)), 1), SEARCH_MAX_RESULTS)
+    except ValueError:
+        return jsonify({"error": "min., max. and limit must be numbers"}), 400
+    category = request.args.get("category")
+    requested = [key.strip() for key in request.args.getlist("facet") if key.strip()]
+
+    conn = get_db()
+    cursor = conn.cursor()
+    where, params = _product_filter_sql(category, filters)
+    total = cursor.execute(f"SELECT COUNT(*) FROM products p WHERE {where}", params).fetchone()[0]
+    products = dict_cursor(conn).execute(f"""
+        SELECT p.id, p.product_name, p.category, p.stock_status, p.image_filename
+        FROM products p
+        WHERE {where}
+        ORDER BY p.product_name, p.id
+        LIMIT ?
+    """, (*params, limit)).fetchall()
+
+    rows = [row for row in _facet_value_counts(cursor, category, filters, keys=requested)
+            if row[0] not in filters]
+    for key in filters:
+        if not requested or key in requested:
+            rows += _facet_value_counts(cursor, category, filters, skip_key=key, keys=[key])
+    if requested:
+        facets = _build_facets(rows, filters, dict.fromkeys(requested, 0))
+    else:
+        # Which keys are worth offering is decided on the whole category, so
+        # narrowing the results does not make the other facets disappear
+        category_rows = _facet_value_counts(cursor, category, {}) if filters else rows
+        facets = _build_facets(rows, filters, _facet_keys(category_rows))[:FACET_KEY_LIMIT]
+    return jsonify({
+        "total": total,
+        "products": [dict(product) for product in products],
+        "facets": facets,
+    })
+
+
 @app.route("/api/products/<category>")
+@conditional_json("products")
 def get_products_by_category(category):
     """Get products by category - API endpoint"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM products WHERE category = ? ORDER BY product_name", (category,))
     products = cursor.fetchall()
-    conn.close()
 
     # Convert to JSON format
     product_list = []
@@ -612,8 +2658,8 @@ def get_products_by_category(category):
             'product_rate': product[4],
             'stock_status': product[5],
             'image_filename': product[6],
-            'created_at': product[7],
-            'updated_at': product[8]
+            'created_at': to_local_time(product[7]),
+            'updated_at': to_local_time(product[8])
         }
         product_list.append(product_dict)
     return jsonify(product_list)
@@ -692,43 +2738,46 @@ def login():
 
 
 
-@app.route("/admin")
-def admin():
-    if not session.get("authenticated"):
-        flash("Please login to access the admin panel")
-        return redirect(url_for("login"))
-    if not session.get("is_admin") or not is_admin_in_db(session.get("user_email")):
-        flash("Admin access required")
-        return redirect(url_for("dashboard"))
+# =========================
+# DASHBOARD METRICS
+# =========================
+DASHBOARD_METRICS_TTL = float(os.getenv("DASHBOARD_METRICS_TTL", "60"))
+_dashboard_metrics_cache = (None, 0.0, None)
 
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    from datetime import datetime, timedelta
-    from zoneinfo import ZoneInfo
-    now_uae = datetime.now(ZoneInfo("Asia/Dubai"))
-    one_week_ago = (datetime.now(ZoneInfo("Asia/Dubai")) - timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S")
-
-    cur.execute("SELECT COUNT(*) FROM orders WHERE datetime(created_at) >= ?", (one_week_ago,))
-    orders_this_week = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM orders WHERE status IN ('inquiry received', 'quote sent')")
-    unplaced_orders = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM orders WHERE status = 'delivered'")
-    delivered_count = cur.fetchone()[0]
 
-    cur.execute("SELECT COUNT(*) FROM products WHERE stock_status = 'in_stock'")
-    in_stock_products = cur.fetchone()[0]
+def get_dashboard_metrics():
+    """Admin dashboard counters, computed in one pass over orders.
 
-    cur.execute("SELECT COUNT(*) FROM users")
-    total_clients = cur.fetchone()[0]
+    Results are reused until the orders/products/users versions change or
+    DASHBOARD_METRICS_TTL expires (the seven-day window keeps sliding).
+    """
+    global _dashboard_metrics_cache
+    versions = get_data_versions("orders", "products", "users")
+    cached_versions, computed_at, dashboard = _dashboard_metrics_cache
+    if cached_versions == versions and time.monotonic() - computed_at < DASHBOARD_METRICS_TTL:
+        return dashboard
 
-    cur.execute("SELECT COUNT(*) FROM orders WHERE status = 'dispatched'")
-    dispatched_count = cur.fetchone()[0]
+    conn = get_db()
+    cur = conn.cursor()
+    one_week_ago = utc_timestamp(datetime.now(timezone.utc) - timedelta(days=7))
+    cur.execute("""
+                SELECT COALESCE(SUM(created_at >= ?), 0),
+                       COALESCE(SUM(status IN ('inquiry received', 'quote sent')), 0),
+                       COALESCE(SUM(status = 'delivered'), 0),
+                       COALESCE(SUM(status = 'dispatched'), 0),
+                       COALESCE(SUM(status NOT IN ('delivered', 'inquiry received', 'quote sent')), 0),
+                       COALESCE(SUM(payment_status = 'unpaid'
+                                    AND status IN ('order placed', 'dispatched', 'delivered')), 0)
+                FROM orders
+                """, (one_week_ago,))
+    (orders_this_week, unplaced_orders, delivered_count,
+     dispatched_count, pending_orders, payment_status_count) = cur.fetchone()
 
-    # Pending (not delivered)
-    cur.execute("SELECT COUNT(*) FROM orders WHERE status NOT IN ('delivered','inquiry received', 'quote sent')")
-    pending_orders = cur.fetchone()[0]
+    cur.execute("""
+                SELECT (SELECT COUNT(*) FROM products WHERE stock_status = 'in_stock'),
+                       (SELECT COUNT(*) FROM users)
+                """)
+    in_stock_products, total_clients = cur.fetchone()
 
     cur.execute("""
                 SELECT product_name, COUNT(*) as inquiries
@@ -748,56 +2797,41 @@ def admin():
                 """)
     client_row = cur.fetchone()
     most_active_client = client_row[0] if client_row else "No Orders Yet"
-    cur.execute("""
-                SELECT MIN(created_at) as first_order_date
-                FROM orders
-                """)
-    cur.execute("""
-                SELECT COUNT(*)
-                FROM orders
-                WHERE payment_status = 'unpaid'
-                  AND status IN ('order placed', 'dispatched', 'delivered')
-                """)
-    payment_status_count = cur.fetchone()[0]
 
-    """
-    first_order_row = cur.fetchone()
-    if first_order_row and first_order_row[0]:
-        # Parse the date and format it nicely
-        from datetime import datetime
-        first_date = datetime.strptime(first_order_row[0], '%Y-%m-%d %H:%M:%S')
-        first_order_month = first_date.strftime('%B %Y')  # e.g., "October 2024"
-    else:
-        first_order_month = None"""
+    dashboard = {
+        "orders_this_week": orders_this_week,
+        "unplaced_orders": unplaced_orders,
+        "delivered_count": delivered_count,
+        "dispatched_count": dispatched_count,
+        "pending_orders": pending_orders,
+        "payment_status_count": payment_status_count,
+        "in_stock_products": in_stock_products,
+        "total_clients": total_clients,
+        "most_inquired_item": most_inquired_item,
+        "most_active_client": most_active_client,
+    }
+    _dashboard_metrics_cache = (versions, time.monotonic(), dashboard)
+    return dashboard
 
 
-    return render_template(
-        "admin.html",
-        section="dashboard",unplaced_orders=unplaced_orders,
-        orders_this_week=orders_this_week,
-        delivered_count=delivered_count,
-        dispatched_count=dispatched_count,
-        pending_orders=pending_orders,
-        in_stock_products=in_stock_products,
-        total_clients=total_clients,
-        most_inquired_item=most_inquired_item,
-    most_active_client = most_active_client, payment_status_count=payment_status_count
-    )
+@app.route("/admin")
+@admin_required
+def admin():
+    return render_template("admin.html", section="dashboard", **get_dashboard_metrics())
 
 
 
 def get_all_admins():
     """Get all admins from the database"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT id, email, created_at FROM admins ORDER BY email")
     admins = cursor.fetchall()
-    conn.close()
     return admins
 
 def add_admin(email):
     """Add a new admin to the database"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     try:
         # Check if user exists as a client first
@@ -810,16 +2844,16 @@ def add_admin(email):
         if client:
             cursor.execute("UPDATE users SET user_type = 'admin' WHERE email = ?", (email.lower(),))
         conn.commit()
+        invalidate_admin_cache()
         return True
     except sqlite3.IntegrityError:
+        conn.rollback()
         return False  # Admin already exists
-    finally:
-        conn.close()
 
 
 def remove_admin(admin_id):
     """Remove an admin and convert them to a client"""
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     # Get the admin email before deletion
     cursor.execute("SELECT email FROM admins WHERE id = ?", (admin_id,))
@@ -829,7 +2863,6 @@ def remove_admin(admin_id):
         # Don't allow removal of main admin
         main_admin_email = os.getenv("ADMIN_EMAIL")
         if admin_email.lower() == main_admin_email.lower():
-            conn.close()
             return False, "Cannot remove main admin"
 
         # Remove from admins table
@@ -848,36 +2881,15 @@ def remove_admin(admin_id):
                              VALUES (?, ?, '', '', '', 'client')""",
                            (admin_email, admin_email.split('@')[0]))
         conn.commit()
-        conn.close()
+        invalidate_admin_cache()
         return True, "Admin removed and converted to client"
 
-    conn.close()
     return False, "Admin not found"
 
-
-def is_admin_in_db(email):
-    """Check if the email belongs to an admin"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT email FROM admins WHERE email = ?", (email.lower(),))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
-
 @app.route("/admin_list")
+@admin_required
 def admin_list():
     """Admin list page - requires admin authentication"""
-    if not session.get("authenticated"):
-        session.clear()
-        flash("Please login to access the admin panel")
-        return redirect(url_for("login"))
-
-    user_email = session.get("user_email")
-    if not user_email or not is_admin_in_db(user_email):
-        session.clear()
-        flash("Admin access required")
-        return redirect(url_for("login"))
-
     admins = get_all_admins()
     main_admin_email = os.getenv("ADMIN_EMAIL")
 
@@ -887,18 +2899,9 @@ def admin_list():
 
 
 @app.route("/admin/add-admin", methods=["POST"])
+@admin_required
 def add_admin_route():
     """Add a new admin - requires admin authentication"""
-    if not session.get("authenticated"):
-        session.clear()
-        flash("Please login to access the admin panel")
-        return redirect(url_for("login"))
-
-    user_email = session.get("user_email")
-    if not user_email or not is_admin_in_db(user_email):
-        session.clear()
-        flash("Admin access required")
-        return redirect(url_for("login"))
     admin_email = request.form.get("admin_email", "").strip().lower()
     # Validate email
     if not admin_email or "@" not in admin_email:
@@ -917,32 +2920,141 @@ def add_admin_route():
 
 
 @app.route("/admin/remove-admin/<int:admin_id>", methods=["POST"])
+@admin_required
 def remove_admin_route(admin_id):
     """Remove an admin - requires admin authentication"""
-    if not session.get("authenticated"):
-        session.clear()
-        flash("Please login to access the admin panel")
-        return redirect(url_for("login"))
-
-    user_email = session.get("user_email")
-    if not user_email or not is_admin_in_db(user_email):
-        session.clear()
-        flash("Admin access required")
-        return redirect(url_for("login"))
-
     success, message = remove_admin(admin_id)
     flash(message)
 
     return redirect(url_for("admin_list"))
 
 
+# =========================
+# UNREAD NOTIFICATIONS
+# =========================
+# Client tabs hold an /api/unread-stream connection instead of polling. Each
+# process runs one watcher thread while it has subscribers: it sleeps until
+# the messages data version moves (a write in any worker) or notify_unread()
+# is called after a local commit, then re-reads the unread counters of the
+# subscribed users only and pushes changed counts to their streams.
+#
+# An open stream holds a worker thread, so each process serves at most
+# UNREAD_STREAM_LIMIT of them (gunicorn.conf.py sets it to half the threads);
+# past that the stream answers 204 and the page polls instead.
+UNREAD_STREAM_MAX_SECONDS = int(os.getenv("UNREAD_STREAM_MAX_SECONDS", "300"))
+UNREAD_STREAM_KEEPALIVE_SECONDS = 15
+UNREAD_STREAM_LIMIT = int(os.getenv("UNREAD_STREAM_LIMIT", "16"))
+UNREAD_WATCH_INTERVAL = float(os.getenv("UNREAD_WATCH_INTERVAL", "1"))
+_unread_subscribers = {}
+_unread_stream_count = 0
+_unread_lock = threading.Lock()
+_unread_wakeup = threading.Event()
+_unread_watcher_pid = None
+
+
+def subscribe_unread(user_email):
+    """Register a stream for user_email; returns the queue its counts arrive on,
+    or None when this process already serves UNREAD_STREAM_LIMIT streams"""
+    global _unread_stream_count
+    updates = queue.Queue(maxsize=1)
+    with _unread_lock:
+        if _unread_stream_count >= UNREAD_STREAM_LIMIT:
+            return None
+        _unread_stream_count += 1
+        _unread_subscribers.setdefault(user_email, set()).add(updates)
+    start_unread_watcher()
+    _unread_wakeup.set()
+    return updates
+
+
+def unsubscribe_unread(user_email, updates):
+    global _unread_stream_count
+    with _unread_lock:
+        streams = _unread_subscribers.get(user_email)
+        if streams is not None and updates in streams:
+            _unread_stream_count -= 1
+            streams.discard(updates)
+            if not streams:
+                del _unread_subscribers[user_email]
+
+
+def notify_unread():
+    """Push fresh counts to this process's streams after committing messages"""
+    _unread_wakeup.set()
+
+
+def _publish_unread(updates, count):
+    # Only the latest count matters, so replace anything the stream has not sent yet
+    try:
+        updates.get_nowait()
+    except queue.Empty:
+        pass
+    updates.put_nowait(count)
+
+
+def _unread_watcher_loop():
+    conn = connect_db()
+    last_version = None
+    last_counts = {}
+    while True:
+        with _unread_lock:
+            emails = list(_unread_subscribers)
+        if not emails:
+            last_counts.clear()
+            _unread_wakeup.wait()
+            _unread_wakeup.clear()
+            continue
+        try:
+            version = conn.execute(
+                "SELECT version FROM data_versions WHERE name = 'messages'"
+            ).fetchone()[0]
+            new_emails = [email for email in emails if email not in last_counts]
+            if version != last_version or new_emails:
+                counts = dict.fromkeys(emails, 0)
+                for start in range(0, len(emails), 500):
+                    batch = emails[start:start + 500]
+                    placeholders = ", ".join("?" for _ in batch)
+                    counts.update(conn.execute(f"""
+                        SELECT user_email, unread FROM unread_counters
+                        WHERE user_email IN ({placeholders})
+                    """, batch).fetchall())
+                conn.commit()
+                with _unread_lock:
+                    for email, count in counts.items():
+                        if last_counts.get(email) != count:
+                            for updates in _unread_subscribers.get(email, ()):
+                                _publish_unread(updates, count)
+                last_counts = counts
+                last_version = version
+        except Exception as e:
+            app.logger.error("Unread watcher error: %s", e)
+            if conn.in_transaction:
+                conn.rollback()
+        _unread_wakeup.wait(UNREAD_WATCH_INTERVAL)
+        _unread_wakeup.clear()
+
+
+def start_unread_watcher():
+    """Start this process's watcher thread once (after any fork)"""
+    global _unread_watcher_pid
+    if _unread_watcher_pid == os.getpid():
+        return
+    with _unread_lock:
+        if _unread_watcher_pid == os.getpid():
+            return
+        threading.Thread(target=_unread_watcher_loop, name="unread-watcher", daemon=True).start()
+        _unread_watcher_pid = os.getpid()
+
+
 @app.context_processor
 def inject_unread_count():
     unread_count = 0
     if session.get("authenticated"):
         user_email = session.get("user_email")
         if user_email:
+            started = time.perf_counter()
             unread_count = get_unread_message_count(user_email)
+            metrics.UNREAD_COUNT_TIME.observe(time.perf_counter() - started)
     return dict(unread_count=unread_count)
 
 @app.route("/api/unread-count")
@@ -954,8 +3066,55 @@ def api_unread_count():
     if not user_email:
         return jsonify({"count": 0})
 
-    count = get_unread_message_count(user_email)
-    return jsonify({"count": count})
+    count = get_unread_message_count(user_email)
+    return jsonify({"count": count})
+
+
+@app.route("/api/unread-stream")
+def api_unread_stream():
+    """Server-sent events carrying the unread count whenever it changes"""
+    user_email = session.get("user_email")
+    if not session.get("authenticated") or not user_email:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    updates = subscribe_unread(user_email)
+    if updates is None:
+        # No stream slot left in this worker; EventSource does not reconnect
+        # after a 204 and the page falls back to polling /api/unread-count
+        return Response(status=204)
+    try:
+        count = get_unread_message_count(user_email)
+    except Exception:
+        unsubscribe_unread(user_email, updates)
+        raise
+
+    def stream():
+        # Streams end after UNREAD_STREAM_MAX_SECONDS to hand the thread back;
+        # EventSource reconnects on its own.
+        yield f"retry: 5000\nevent: unread\ndata: {json.dumps({'count': count})}\n\n"
+        sent = count
+        deadline = time.monotonic() + UNREAD_STREAM_MAX_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                latest = updates.get(timeout=min(UNREAD_STREAM_KEEPALIVE_SECONDS, remaining))
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            # The watcher also publishes the count just sent when it picks
+            # this subscriber up; only changes are worth an event
+            if latest != sent:
+                sent = latest
+                yield f"event: unread\ndata: {json.dumps({'count': latest})}\n\n"
+
+    response = Response(stream(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Runs when the server closes the response, even if the client went away
+    # before the generator started, so the slot is always given back
+    response.call_on_close(lambda: unsubscribe_unread(user_email, updates))
+    return response
 
 
 @app.route("/place_order", methods=["POST"])
@@ -972,25 +3131,19 @@ def place_order():
     if not product_id or not expected_date or not quantity_value or not quantity_unit:
         flash("Missing required fields", "danger")
         return redirect(url_for("dashboard"))
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT product_name FROM products WHERE id = ?", (product_id,))
     row = cursor.fetchone()
-    conn.close()
     if not row:
         flash("Invalid product selected", "danger")
         return redirect(url_for("dashboard"))
     product_name = row[0] if row else None
-    print(product_name)
     quantity = f"{quantity_value} {quantity_unit}".strip()
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
     cursor.execute("""
-        INSERT INTO orders (product_name, expected_date, quantity, comments, user_email,status, last_updated)
-        VALUES (?, ?, ?, ?, ?, "inquiry received", datetime('now', '+4 hours'))
-    """, (product_name, expected_date, quantity, comments, user_email))
-    conn.commit()
-    conn.close()
+        INSERT INTO orders (product_id, product_name, expected_date, quantity, comments, user_email,status, last_updated)
+        VALUES (?, ?, ?, ?, ?, ?, "inquiry received", CURRENT_TIMESTAMP)
+    """, (product_id, product_name, expected_date, quantity, comments, user_email))
     subject = "New Order Placed"
     body = f"""A new order has been placed:
     Product Name: {product_name}
@@ -1000,30 +3153,16 @@ def place_order():
     Ordered by: {user_email}
     """
     admin_email = os.getenv("ADMIN_EMAIL")
-    from_email = os.getenv("SENDER_GMAIL_ADDRS")
-    sendgrid_key = os.getenv("SENDGRID_API_KEY")
-    if not admin_email or not from_email or not sendgrid_key:
+    from_email = default_sender()
+    if not admin_email or not from_email or not email_configured():
+        conn.commit()
         flash("Order saved but email configuration is missing.", "warning")
         return redirect(url_for("dashboard"))
 
-    try:
-        message = Mail(
-            from_email=from_email,
-            to_emails=admin_email,
-            subject=subject,
-            plain_text_content=body
-        )
-
-        sg = SendGridAPIClient(sendgrid_key)
-        response = sg.send(message)
-
-        if response.status_code not in (200, 202):
-            raise Exception(f"SendGrid error: {response.status_code}")
-
-        flash("Order placed successfully!", "success")
-    except Exception as e:
-        app.logger.error("Error sending order email via SendGrid: %s", e)
-        flash("Order saved but email notification failed (check logs).", "warning")
+    enqueue_email(cursor, admin_email, subject, plain_text_content=body, from_email=from_email)
+    conn.commit()
+    notify_outbox()
+    flash("Order placed successfully!", "success")
     return redirect(url_for("dashboard"))
 
 @app.route("/dashboard")
@@ -1032,69 +3171,39 @@ def dashboard():
     if not session.get("authenticated"):
         flash("Please login to access the dashboard")
         return redirect(url_for("login"))
-    user_email = session.get("user_email")
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM products")
-    rows = cursor.fetchall()
-    conn.close()
-    products_list = []
-    for row in rows:
-        products_list.append({
-            "id": row[0],
-            "name": row[1],
-            "category": row[2],
-            "options": json.loads(row[3]) if row[3] else {},
-            "rate": row[4],
-            "stock": row[5],
-            "image": row[6]
-        })
-    all_categories = [
-        "Winches", "Cable Drum Trailers","Rollers","Cable Drum Lifting Jacks","Cable Locators","Reeling Machine",
-        "Cable Pulling Grips & Swivel Link","Duct Rods", "Hydraulic Cutting and Crimping Tools",
-        "Warning Tapes", "Manhole", "Ropes", "Duct","Electrical", "Solar",
-        "Pipes","Optical Fibre Cables","Optical Fiber Connectors" ,"Optical Fiber Adapters",
-        "Optical Fiber Consumable","Optical Fiber Instruments", "Optical Distribution Frames",
-        "Optical Fiber Patch Cord","Optical Fiber Tools","Cabinets","Cable Joint Products",
-        "Cable & Wires", "Connectors", "Distribution Boxes", "Ducts Accessories",
-        "Manhole Accessories", "Marking & Protection","Earthing Hardware","Miscellaneous", "Poles & Accessories",
-        "Tapes","Terminal Blocks","Test & Measurement","Telecom Tools","Other Products"]
-    products_by_cat = {cat: [] for cat in all_categories}
-    for product in products_list:
-        cat = product["category"] if product["category"] in all_categories else "Other Products"
-        products_by_cat[cat].append(product)
-    return render_template(
-        "dashboard.html",
-        products_by_cat=products_by_cat,all_categories=all_categories
+    # The product grid is the same for every client; only the page around it is per user
+    catalogue = get_catalogue()
+    catalogue_grid = render_catalogue_fragment(
+        catalogue, "catalogue_grid.html",
+        products_by_cat=catalogue["products_by_cat"], all_categories=catalogue["categories"]
     )
+    return render_template("dashboard.html", catalogue_grid=catalogue_grid)
 @app.route("/admin/client-orders")
+@admin_required
 def client_orders():
-    if not session.get("authenticated") or not session.get("is_admin"):
-        flash("Admin access required")
-        return redirect(url_for("login"))
-    if not session.get("is_admin") or not is_admin_in_db(session.get("user_email")):
-        flash("Admin access required")
-        return redirect(url_for("dashboard"))
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM orders ORDER BY datetime(last_updated) DESC")
-    orders = cursor.fetchall()
-    conn.close()
-    return render_template("admin.html", section="client-orders", orders=orders)
+    try:
+        limit, after = page_args()
+    except ValueError:
+        return redirect(url_for("client_orders"))
+    conn = get_db()
+    rows, next_cursor = fetch_orders_page(conn.cursor(), "id, last_updated, *", after=after, limit=limit)
+    # The template reads orders positionally as SELECT * rows
+    orders = [row[2:] for row in rows]
+    if request.args.get("fragment") == "rows":
+        # "Load more" on the page fetches just the next batch of list items
+        return with_next_cursor(
+            app.make_response(render_template("client_order_rows.html", orders=orders)), next_cursor)
+    return render_template("admin.html", section="client-orders", orders=orders, next_cursor=next_cursor)
 
 
 
 @app.route("/admin/delete-order/<int:order_id>", methods=["POST"])
+@admin_required
 def delete_order(order_id):
-    if not session.get("authenticated") or not session.get("is_admin"):
-        flash("Admin access required")
-        return redirect(url_for("login"))
-
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM orders WHERE id = ?", (order_id,))
     conn.commit()
-    conn.close()
 
     flash("Order deleted successfully!", "success")
     return redirect(url_for("client_orders"))
@@ -1106,24 +3215,19 @@ def my_orders():
         return redirect(url_for("login"))
 
     user_email = session.get("user_email")
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    conn = get_db()
+    cursor = dict_cursor(conn)
     cursor.execute(
         "SELECT * FROM orders WHERE user_email = ? ORDER BY created_at DESC",
         (user_email,)
     )
     orders = cursor.fetchall()
-    conn.close()
 
     return render_template("my_orders.html", orders=orders)
 
 @app.route("/admin/send-quotation", methods=["POST"])
+@admin_required
 def send_quotation():
-    if not session.get("authenticated") or not session.get("is_admin"):
-        flash("Admin access required", "danger")
-        return redirect(url_for("login"))
-
     order_id = request.form.get("id", "").strip()
     client_email = request.form.get("user_email", "").strip()
     message_body = request.form.get("message", "")
@@ -1136,7 +3240,7 @@ def send_quotation():
     # =========================
     # FETCH ORDER DETAILS
     # =========================
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT product_name, quantity FROM orders WHERE id = ?", (order_id,))
     order_row = cursor.fetchone()
@@ -1145,9 +3249,8 @@ def send_quotation():
     order_quantity = order_row[1] if order_row else "N/A"
 
     # =========================
-    # PREPARE SENDGRID EMAIL
+    # PREPARE EMAIL
     # =========================
-    sendgrid_api_key = os.getenv("SENDGRID_API_KEY")
     from_email = os.getenv("ADMIN_EMAIL")
 
     html_content = f"""
@@ -1169,45 +3272,25 @@ def send_quotation():
     </div>
     """
 
-    mail = Mail(
-        from_email=from_email,
-        to_emails=client_email,
-        subject=f"Quotation for Order #{order_id}: {order_name} ({order_quantity})",
-        html_content=html_content
-    )
-
     attachment_name = None
+    file_path = None
 
     # =========================
     # HANDLE ATTACHMENT
     # =========================
-    if attachment and attachment.filename:
-        attachment_name = secure_filename(attachment.filename)
-        upload_dir = os.path.join("static", "uploads", "products")
-        os.makedirs(upload_dir, exist_ok=True)
-        file_path = os.path.join(upload_dir, attachment_name)
-        # 1️⃣ SAVE for website rendering
-        attachment.save(file_path)
-        # 2️⃣ READ for SendGrid email
-        with open(file_path, "rb") as f:
-            encoded_file = base64.b64encode(f.read()).decode()
-        sg_attachment = Attachment(
-            FileContent(encoded_file),
-            FileName(attachment_name),
-            FileType(attachment.content_type),
-            Disposition("attachment")
-        )
-        mail.add_attachment(sg_attachment)
     try:
-        sg = SendGridAPIClient(sendgrid_api_key)
-        sg.send(mail)
+        if attachment and attachment.filename:
+            # Streamed into the private attachment store; the email worker
+            # reads it from there and sends it under the original name
+            attachment_name = store_upload(cursor, attachment, prefix=ATTACHMENT_PREFIX)
+            file_path = stored_file_path(attachment_name)
         cursor.execute("""
             INSERT INTO messages (
                 order_id, user_email, subject, body,
                 attachment_name, order_name, order_quantity,
                 created_at, is_read
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'), 0)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, 0)
         """, (
             order_id,
             client_email,
@@ -1220,68 +3303,92 @@ def send_quotation():
         cursor.execute("""
             UPDATE orders
             SET status = 'quote sent',
-                last_updated = datetime('now', '+4 hours')
+                last_updated = CURRENT_TIMESTAMP
             WHERE id = ?
         """, (order_id,))
+        emailed = bool(from_email) and email_configured()
+        if emailed:
+            enqueue_email(
+                cursor, client_email,
+                f"Quotation for Order #{order_id}: {order_name} ({order_quantity})",
+                html_content=html_content,
+                from_email=from_email,
+                attachment_path=file_path,
+                attachment_name=(secure_filename(attachment.filename) or os.path.basename(file_path)) if file_path else None,
+                attachment_type=attachment.content_type if file_path else None
+            )
 
         conn.commit()
-        flash(f"Quotation sent successfully to {client_email}", "success")
+        notify_outbox()
+        notify_unread()
+        if emailed:
+            flash(f"Quotation sent successfully to {client_email}", "success")
+        else:
+            flash("Quotation saved to the client's messages but email configuration is missing.", "warning")
 
     except Exception as e:
         conn.rollback()
-        app.logger.error("SendGrid quotation error: %s", e)
+        app.logger.error("Quotation error: %s", e)
         flash("Failed to send quotation email.", "danger")
-    finally:
-        conn.close()
     return redirect(url_for("client_orders"))
 
 
-@app.route("/admin/dispatch-order/<int:order_id>", methods=["POST"])
-def dispatch_order(order_id):
-    if not session.get("authenticated") or not session.get("is_admin"):
-        flash("Admin access required", "danger")
-        return redirect(url_for("login"))
-
-    # =========================
-    # FETCH ORDER
-    # =========================
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT id, user_email, product_name, quantity
-        FROM orders
-        WHERE id = ?
-    """, (order_id,))
-    order = cursor.fetchone()
-
-    if not order:
-        conn.close()
-        flash("Order not found", "danger")
-        return redirect(url_for("admin_dashboard"))
-
-    order_id, client_email, product_name, quantity = order
-
-    # =========================
-    # EMAIL CONTENT
-    # =========================
+# Dispatch and delivery go through transition_orders(), one order or many:
+# the status guard in its UPDATE makes a repeated submit a no-op, every moved
+# order gets its in-app message, and each client gets one email for the batch.
+ORDER_TRANSITIONS = {
+    "dispatch": {
+        "from_status": "order placed",
+        "to_status": "dispatched",
+        "subject": "Order Dispatched",
+        "subject_plural": "Orders Dispatched",
+        "heading": "Your Order Has Been Dispatched 🚚",
+        "heading_plural": "Your Orders Have Been Dispatched 🚚",
+        "intro": "<p>Good news! Your order has been dispatched and is on its way.</p>",
+        "intro_plural": "<p>Good news! The following orders have been dispatched and are on their way.</p>",
+        "closing": "<p>\n            If you have any questions, feel free to contact us.\n        </p>",
+        "message": "Your order #{order_id} has been dispatched.",
+        "sent_flash": "Dispatch notification sent to {client_email} and order marked as dispatched",
+        "error_flash": "Failed to send dispatch notification.",
+    },
+    "deliver": {
+        "from_status": "dispatched",
+        "to_status": "delivered",
+        "subject": "Order Delivered",
+        "subject_plural": "Orders Delivered",
+        "heading": "✅ Order Delivered Successfully",
+        "heading_plural": "✅ Orders Delivered Successfully",
+        "intro": "<p>\n            We’re happy to inform you that your order has been successfully delivered.\n        </p>",
+        "intro_plural": "<p>\n            We’re happy to inform you that the following orders have been successfully delivered.\n        </p>",
+        "closing": "<p>\n            Thank you for choosing <strong>Elfit Arabia</strong>.\n"
+                   "            We hope you’re satisfied with your purchase.\n        </p>",
+        "message": "Your order #{order_id} has been delivered successfully.",
+        "sent_flash": "Delivery confirmation sent to {client_email} and order marked as delivered",
+        "error_flash": "Failed to send delivery confirmation.",
+    },
+}
+BULK_TRANSITION_MAX = 500
+
+
+def order_transition_email(transition, orders):
+    """Subject and HTML telling one client about their orders in a transition"""
+    plural = len(orders) > 1
+    details = "\n        <hr>\n".join(f"""
+        <p><strong>Order ID:</strong> #{order_id}</p>
+        <p><strong>Product:</strong> {product_name}</p>
+        <p><strong>Quantity:</strong> {quantity}</p>
+""" for order_id, _, product_name, quantity in orders)
     html_content = f"""
     <div style="font-family:Arial; max-width:600px;">
-        <h2>Your Order Has Been Dispatched 🚚</h2>
+        <h2>{transition["heading_plural" if plural else "heading"]}</h2>
 
-        <p>Good news! Your order has been dispatched and is on its way.</p>
+        {transition["intro_plural" if plural else "intro"]}
 
         <hr>
-
-        <p><strong>Order ID:</strong> #{order_id}</p>
-        <p><strong>Product:</strong> {product_name}</p>
-        <p><strong>Quantity:</strong> {quantity}</p>
-
+{details}
         <hr>
 
-        <p>
-            If you have any questions, feel free to contact us.
-        </p>
+        {transition["closing"]}
 
         <small>
             Elfit Arabia<br>
@@ -1289,168 +3396,136 @@ def dispatch_order(order_id):
         </small>
     </div>
     """
-    mail = Mail(
-        from_email=os.getenv("ADMIN_EMAIL"),
-        to_emails=client_email,
-        subject=f"Order Dispatched – Order #{order_id}: {product_name}",
-        html_content=html_content
-    )
-    try:
-        sg = SendGridAPIClient(os.getenv("SENDGRID_API_KEY"))
-        sg.send(mail)
+    if plural:
+        subject = f"{len(orders)} {transition['subject_plural']} – " + \
+                  ", ".join(f"#{order[0]}" for order in orders)
+    else:
+        subject = f"{transition['subject']} – Order #{orders[0][0]}: {orders[0][2]}"
+    return subject, html_content
 
-        cursor.execute("""
-            INSERT INTO messages (
-                order_id, user_email, subject, body,
-                attachment_name, order_name, order_quantity,
-                created_at, is_read
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'), 0)
-        """, (
-            order_id,
-            client_email,
-            f"Order Dispatched – Order #{order_id}",
-            f"Your order #{order_id} has been dispatched.",
-            None,
-            product_name,
-            quantity
-        ))
 
-        cursor.execute("""
-            UPDATE orders
-            SET status = 'dispatched',
-                last_updated = datetime('now', '+4 hours')
-            WHERE id = ?
-        """, (order_id,))
+def transition_orders(cursor, action, order_ids):
+    """Move orders along ORDER_TRANSITIONS[action] in the caller's transaction.
 
-        conn.commit()
-        flash(
-            f"Dispatch notification sent to {client_email} and order marked as dispatched",
-            "success"
+    Only orders still in the from-status move. Queues one message per order
+    and one email per client; returns the moved (id, user_email,
+    product_name, quantity) rows.
+    """
+    transition = ORDER_TRANSITIONS[action]
+    moved = cursor.execute("""
+        UPDATE orders
+        SET status = ?,
+            last_updated = CURRENT_TIMESTAMP
+        WHERE status = ? AND id IN (SELECT value FROM json_each(?))
+        RETURNING id, user_email, product_name, quantity
+    """, (transition["to_status"], transition["from_status"], json.dumps(list(order_ids)))).fetchall()
+    moved.sort()
+
+    cursor.executemany("""
+        INSERT INTO messages (
+            order_id, user_email, subject, body,
+            attachment_name, order_name, order_quantity,
+            created_at, is_read
         )
+        VALUES (?, ?, ?, ?, NULL, ?, ?, CURRENT_TIMESTAMP, 0)
+    """, [
+        (order_id, client_email, f"{transition['subject']} – Order #{order_id}",
+         transition["message"].format(order_id=order_id), product_name, quantity)
+        for order_id, client_email, product_name, quantity in moved
+    ])
+
+    by_client = {}
+    for order in moved:
+        if order[1]:
+            by_client.setdefault(order[1], []).append(order)
+    from_email = os.getenv("ADMIN_EMAIL")
+    if not from_email or not email_configured():
+        return moved
+    for client_email, orders in by_client.items():
+        subject, html_content = order_transition_email(transition, orders)
+        enqueue_email(cursor, client_email, subject, html_content=html_content, from_email=from_email)
+    return moved
 
-    except Exception as e:
-        conn.rollback()
-        app.logger.error("SendGrid dispatch error: %s", e)
-        flash("Failed to send dispatch notification.", "danger")
-
-    finally:
-        conn.close()
-
-    return redirect(url_for("client_orders"))
-
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-
-@app.route("/admin/mark-delivered/<int:order_id>", methods=["POST"])
-def mark_delivered(order_id):
-    if not session.get("authenticated") or not session.get("is_admin"):
-        flash("Admin access required", "danger")
-        return redirect(url_for("login"))
 
-    # =========================
-    # FETCH ORDER
-    # =========================
-    conn = sqlite3.connect(DATABASE)
+def _transition_single_order(action, order_id):
+    transition = ORDER_TRANSITIONS[action]
+    conn = get_db()
     cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT id, user_email, product_name, quantity
-        FROM orders
-        WHERE id = ?
-    """, (order_id,))
+    cursor.execute("SELECT status FROM orders WHERE id = ?", (order_id,))
     order = cursor.fetchone()
-
     if not order:
-        conn.close()
         flash("Order not found", "danger")
-        return redirect(url_for("admin_dashboard"))
-
-    order_id, client_email, product_name, quantity = order
-
-    # =========================
-    # EMAIL CONTENT
-    # =========================
-    html_content = f"""
-    <div style="font-family:Arial; max-width:600px;">
-        <h2>✅ Order Delivered Successfully</h2>
+        return redirect(url_for("client_orders"))
 
-        <p>
-            We’re happy to inform you that your order has been successfully delivered.
-        </p>
+    try:
+        moved = transition_orders(cursor, action, [order_id])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        app.logger.error("Order %s error: %s", action, e)
+        flash(transition["error_flash"], "danger")
+        return redirect(url_for("client_orders"))
 
-        <hr>
+    if moved:
+        notify_outbox()
+        notify_unread()
+        flash(transition["sent_flash"].format(client_email=moved[0][1]), "success")
+    else:
+        flash(f"Order #{order_id} is {order[0]}, not {transition['from_status']}; nothing was sent", "warning")
+    return redirect(url_for("client_orders"))
 
-        <p><strong>Order ID:</strong> #{order_id}</p>
-        <p><strong>Product:</strong> {product_name}</p>
-        <p><strong>Quantity:</strong> {quantity}</p>
 
-        <hr>
+@app.route("/admin/dispatch-order/<int:order_id>", methods=["POST"])
+@admin_required
+def dispatch_order(order_id):
+    return _transition_single_order("dispatch", order_id)
 
-        <p>
-            Thank you for choosing <strong>Elfit Arabia</strong>.
-            We hope you’re satisfied with your purchase.
-        </p>
 
-        <small>
-            Elfit Arabia<br>
-            B2B Procurement Platform
-        </small>
-    </div>
-    """
+@app.route("/admin/mark-delivered/<int:order_id>", methods=["POST"])
+@admin_required
+def mark_delivered(order_id):
+    return _transition_single_order("deliver", order_id)
 
-    mail = Mail(
-        from_email=os.getenv("ADMIN_EMAIL"),
-        to_emails=client_email,
-        subject=f"Order Delivered – Order #{order_id}: {product_name}",
-        html_content=html_content
-    )
 
-    # =========================
-    # SEND EMAIL + UPDATE DB
-    # =========================
+@app.route("/admin/orders/transition", methods=["POST"])
+@admin_required
+def bulk_transition_orders():
+    """Dispatch or deliver every selected order in one transaction"""
+    action = request.form.get("action", "")
     try:
-        sg = SendGridAPIClient(os.getenv("SENDGRID_API_KEY"))
-        sg.send(mail)
-
-        cursor.execute("""
-            INSERT INTO messages (
-                order_id, user_email, subject, body,
-                attachment_name, order_name, order_quantity,
-                created_at, is_read
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'), 0)
-        """, (
-            order_id,
-            client_email,
-            f"Order Delivered – Order #{order_id}",
-            f"Your order #{order_id} has been delivered successfully.",
-            None,
-            product_name,
-            quantity
-        ))
-
-        cursor.execute("""
-            UPDATE orders
-            SET status = 'delivered',
-                last_updated = datetime('now', '+4 hours')
-            WHERE id = ?
-        """, (order_id,))
+        order_ids = sorted({int(order_id) for order_id in request.form.getlist("order_ids")})
+    except ValueError:
+        order_ids = []
+    if action not in ORDER_TRANSITIONS or not order_ids:
+        flash("Select some orders and an action first.", "warning")
+        return redirect(url_for("client_orders"))
+    if len(order_ids) > BULK_TRANSITION_MAX:
+        flash(f"Select at most {BULK_TRANSITION_MAX} orders at a time.", "warning")
+        return redirect(url_for("client_orders"))
 
+    transition = ORDER_TRANSITIONS[action]
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        moved = transition_orders(cursor, action, order_ids)
         conn.commit()
-        flash(
-            f"Delivery confirmation sent to {client_email} and order marked as delivered",
-            "success"
-        )
-
     except Exception as e:
         conn.rollback()
-        app.logger.error("SendGrid delivery error: %s", e)
-        flash("Failed to send delivery confirmation.", "danger")
-
-    finally:
-        conn.close()
+        app.logger.error("Bulk order %s error: %s", action, e)
+        flash("Failed to update the selected orders; nothing was changed.", "danger")
+        return redirect(url_for("client_orders"))
 
+    notify_outbox()
+    notify_unread()
+    if not moved:
+        flash(f"None of the selected orders are {transition['from_status']} any more; nothing was sent.", "warning")
+        return redirect(url_for("client_orders"))
+    clients = len({order[1] for order in moved if order[1]})
+    message = f"{len(moved)} order(s) marked as {transition['to_status']}; {clients} client(s) notified"
+    skipped = len(order_ids) - len(moved)
+    if skipped:
+        message += f". {skipped} skipped because they were no longer {transition['from_status']}"
+    flash(message, "success")
     return redirect(url_for("client_orders"))
 
 
@@ -1461,9 +3536,8 @@ def my_messages():
         return redirect(url_for("login"))
 
     user_email = session.get("user_email")
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    conn = get_db()
+    cursor = dict_cursor(conn)
 
     # Get messages with their corresponding order status
     cursor.execute("""
@@ -1490,11 +3564,11 @@ def my_messages():
                    UPDATE messages
                    SET is_read = 1
                    WHERE user_email = ?
-                     AND (is_read = 0 OR is_read IS NULL)
+                     AND is_read = 0
                    """, (user_email,))
 
     conn.commit()
-    conn.close()
+    notify_unread()
 
     return render_template("my_messages.html", messages=messages)
 
@@ -1507,9 +3581,8 @@ def cancel_order(order_id):
 
     user_email = session.get("user_email")
 
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    conn = get_db()
+    cursor = dict_cursor(conn)
 
     # Get order details and verify ownership
     cursor.execute("""
@@ -1521,19 +3594,16 @@ def cancel_order(order_id):
 
     if not order:
         flash("Order not found", "danger")
-        conn.close()
         return redirect(url_for("my_messages"))
 
     # Verify the order belongs to the current user
     if order["user_email"] != user_email:
         flash("Unauthorized action", "danger")
-        conn.close()
         return redirect(url_for("my_messages"))
 
     # Check if order can be cancelled
     if order["status"] in ["delivered", "dispatched", "cancelled"]:
         flash(f"Cannot cancel order with status: {order['status']}", "warning")
-        conn.close()
         return redirect(url_for("my_messages"))
 
     order_name = order["product_name"]
@@ -1544,15 +3614,15 @@ def cancel_order(order_id):
         cursor.execute("""
                        UPDATE orders
                        SET status       = 'cancelled',
-                           last_updated = datetime('now', '+4 hours')
+                           last_updated = CURRENT_TIMESTAMP
                        WHERE id = ?
                        """, (order_id,))
 
-        # Send cancellation email to admin
+        # Queue cancellation email to admin
         admin_email = os.getenv("ADMIN_EMAIL")
         from_email = os.getenv("ADMIN_EMAIL")
 
-        if admin_email and from_email:
+        if admin_email and from_email and email_configured():
             cancel_content = f"""
             <div style="font-family:Arial; max-width:600px;">
                 <h2 style="color: #dc3545;">Order Cancelled by Client</h2>
@@ -1570,27 +3640,21 @@ def cancel_order(order_id):
             </div>
             """
 
-            try:
-                mail = Mail(
-                    from_email=from_email,
-                    to_emails=admin_email,
-                    subject=f"Order Cancelled - #{order_id}: {order_name}",
-                    html_content=cancel_content
-                )
-                sg = SendGridAPIClient(os.getenv("SENDGRID_API_KEY"))
-                sg.send(mail)
-            except Exception as e:
-                app.logger.error(f"Failed to send cancellation email: {e}")
+            enqueue_email(
+                cursor, admin_email,
+                f"Order Cancelled - #{order_id}: {order_name}",
+                html_content=cancel_content,
+                from_email=from_email
+            )
 
         conn.commit()
+        notify_outbox()
         flash("Order cancelled successfully. Admin has been notified.", "success")
 
     except Exception as e:
         conn.rollback()
         app.logger.error(f"Error cancelling order: {e}")
         flash("Failed to cancel order. Please try again.", "danger")
-    finally:
-        conn.close()
 
     return redirect(url_for("my_messages"))
 
@@ -1603,9 +3667,8 @@ def finalize_order(order_id):
 
     user_email = session.get("user_email")
 
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+    conn = get_db()
+    cursor = dict_cursor(conn)
 
     # Get the order details
     cursor.execute("""
@@ -1617,19 +3680,16 @@ def finalize_order(order_id):
 
     if not order:
         flash("Order not found", "danger")
-        conn.close()
         return redirect(url_for("my_messages"))
 
     # Verify ownership
     if order["user_email"] != user_email:
         flash("Unauthorized action", "danger")
-        conn.close()
         return redirect(url_for("my_messages"))
 
     # Check if order can be placed
     if order["status"] not in ["quote sent", "inquiry received"]:
         flash(f"Cannot confirm order with current status: {order['status']}", "warning")
-        conn.close()
         return redirect(url_for("my_messages"))
 
     order_name = order["product_name"]
@@ -1640,16 +3700,15 @@ def finalize_order(order_id):
         cursor.execute("""
                        UPDATE orders
                        SET status       = 'order placed',
-                           last_updated = datetime('now', '+4 hours')
+                           last_updated = CURRENT_TIMESTAMP
                        WHERE id = ?
                        """, (order_id,))
 
-        # Send confirmation email to admin
+        # Queue confirmation email to admin
         admin_email = os.getenv("ADMIN_EMAIL")
         from_email = os.getenv("ADMIN_EMAIL")
-        sendgrid_api_key = os.getenv("SENDGRID_API_KEY")
 
-        if admin_email and from_email and sendgrid_api_key:
+        if admin_email and from_email and email_configured():
             admin_email_content = f"""
             <div style="font-family:Arial; max-width:600px;">
                 <h2 style="color: #198754;">✅ New Order Confirmation</h2>
@@ -1668,22 +3727,19 @@ def finalize_order(order_id):
             </div>
             """
 
-            admin_message = Mail(
-                from_email=from_email,
-                to_emails=admin_email,
-                subject=f"✅ Order Confirmed - #{order_id}: {order_name}",
-                html_content=admin_email_content
+            enqueue_email(
+                cursor, admin_email,
+                f"✅ Order Confirmed - #{order_id}: {order_name}",
+                html_content=admin_email_content,
+                from_email=from_email
             )
 
-            sg = SendGridAPIClient(sendgrid_api_key)
-            sg.send(admin_message)
-
         # Insert confirmation message for the user
         cursor.execute("""
                        INSERT INTO messages (order_id, user_email, subject, body,
                                              attachment_name, order_name, order_quantity,
                                              created_at, is_read)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'), 0)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, 0)
                        """, (
                            order_id,
                            user_email,
@@ -1694,13 +3750,13 @@ def finalize_order(order_id):
                            order_quantity
                        ))
         conn.commit()
+        notify_outbox()
+        notify_unread()
         flash("Order confirmed successfully! Admin has been notified.", "success")
     except Exception as e:
         conn.rollback()
         app.logger.error(f"Error confirming order: {e}")
         flash("Order status updated but notification may have failed.", "warning")
-    finally:
-        conn.close()
     return redirect(url_for("my_messages"))
 
 @app.route("/contact-us")
@@ -1711,7 +3767,7 @@ def contact_us():
 
 @app.route("/talk-further/<int:message_id>")
 def talk_further(message_id):
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM messages WHERE id=?", (message_id,))
     msg = cursor.fetchone()
@@ -1723,7 +3779,6 @@ def talk_further(message_id):
     order_name = msg[6]
     order_quantity = msg[7]
     admin_whatsapp = os.getenv("ADMIN_WHATSAPP")
-    conn.close()
     text = f"""Hello Admin, I want to discuss further about my PLACED ORDER.\n\n"
            Order ID: {order_id}\n
            Order: {order_name} ({order_quantity})\n" 
@@ -1766,13 +3821,11 @@ def register():
 
 
 @app.route("/api/orders/inquired")
+@admin_required
 def get_inquired_items():
     """API endpoint to get ALL items that have ever been ordered with counts"""
-    if not session.get("authenticated") or not session.get("is_admin"):
-        return jsonify({"error": "Unauthorized"}), 401
-
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cur = conn.cursor()
 
         # Get ALL products that have ever been ordered, regardless of status
@@ -1785,7 +3838,6 @@ def get_inquired_items():
 
         cur.execute(query)
         rows = cur.fetchall()
-        conn.close()
 
         # Format results
         items = []
@@ -1805,189 +3857,94 @@ def get_inquired_items():
 
 
 @app.route("/api/dashboard-data")
+@admin_required
 def dashboard_data():
-    conn = sqlite3.connect(DATABASE)
-    cur = conn.cursor()
-    # UAE timezone
-    now_uae = datetime.now(ZoneInfo("Asia/Dubai"))
-    one_week_ago = now_uae - timedelta(days=7)
-    # --- Metrics ---
-    cur.execute("SELECT COUNT(*) FROM orders WHERE datetime(created_at) >= ?", (one_week_ago,))
-    orders_this_week = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM orders WHERE status IN ('inquiry placed', 'quote sent')")
-    unplaced_orders = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM orders WHERE status = 'delivered'")
-    delivered_count = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM products WHERE stock_status = 'in_stock'")
-    in_stock_products = cur.fetchone()[0]
-
-    cur.execute("SELECT COUNT(*) FROM users")
-    total_clients = cur.fetchone()[0]
-
-    return jsonify({
-        "orders_this_week": orders_this_week,
-        "delivered_count": delivered_count,
-        "in_stock_products": in_stock_products,
-        "total_clients": total_clients,"unplaced_orders": unplaced_orders
-    })
+    return jsonify(get_dashboard_metrics())
 
 
 
 
+# Order writes change the ETag at once; the five-minute roll-over only lets
+# orders age out of the rolling "week" list when nothing was written.
 @app.route("/api/orders/<category>")
+@admin_required
+@conditional_json("orders", max_staleness=300)
 def get_orders_by_category(category):
-    """API endpoint to get orders by category"""
-    if not session.get("authenticated") or not session.get("is_admin"):
-        return jsonify({"error": "Unauthorized"}), 401
-
+    """API endpoint to get orders by category, one keyset page at a time"""
     try:
-        conn = sqlite3.connect(DATABASE)
+        limit, after = page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        conn = get_db()
         cur = conn.cursor()
 
-        now_uae = datetime.now(ZoneInfo("Asia/Dubai"))
-        one_week_ago = (now_uae - timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S")
+        one_week_ago = utc_timestamp(datetime.now(timezone.utc) - timedelta(days=7))
 
-        # Define queries based on category
+        # Filter for each category
+        statuses, where, params = None, None, ()
         if category == "week":
-            query = """
-                    SELECT id, \
-                           product_name, \
-                           user_email, \
-                           quantity, \
-                           expected_date,
-                           status, \
-                           last_updated, \
-                           comments, \
-                           created_at
-                    FROM orders
-                    WHERE datetime(last_updated) >= ?
-                    ORDER BY datetime(last_updated) DESC \
-                    """
-            params = (one_week_ago,)
-
+            where, params = "last_updated >= ?", (one_week_ago,)
         elif category == "delivered":
-            query = """
-                    SELECT id, \
-                           product_name, \
-                           user_email, \
-                           quantity, \
-                           expected_date,
-                           status, \
-                           last_updated, \
-                           comments, \
-                           created_at
-                    FROM orders
-                    WHERE status = 'delivered'
-                    ORDER BY datetime(last_updated) DESC \
-                    """
-            params = ()
-
+            statuses = ("delivered",)
         elif category == "pending":
-            query= """
-                        SELECT id, \
-                           product_name, \
-                           user_email, \
-                           quantity, \
-                           expected_date,
-                           status, \
-                           last_updated, \
-                           comments, \
-                           created_at
-                        FROM orders
-                        WHERE status IN ('dispatched', 'order placed')
-                        ORDER BY last_updated DESC
-                        """
-            params = ()
-
-
+            statuses = ("dispatched", "order placed")
         elif category == "dispatched":
-            query = """
-                    SELECT id, \
-                           product_name, \
-                           user_email, \
-                           quantity, \
-                           expected_date,
-                           status, \
-                           last_updated, \
-                           comments, \
-                           created_at
-                    FROM orders
-                    WHERE status = 'dispatched'
-                    ORDER BY datetime(last_updated) DESC \
-                    """
-            params = ()
-
+            statuses = ("dispatched",)
         elif category == "unplaced":
-            query = """
-                    SELECT id,
-                           product_name,
-                           user_email,
-                           quantity,
-                           expected_date,
-                           status,
-                           last_updated,
-                           comments,
-                           created_at
-                    FROM orders
-                    WHERE status IN ('inquiry received', 'quote sent')
-                    ORDER BY last_updated DESC \
-                    """
-            params = ()
-
-
+            statuses = ("inquiry received", "quote sent")
         else:
             return jsonify({"error": "Invalid category"}), 400
 
-        # Execute query
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        conn.close()
+        rows, next_cursor = fetch_orders_page(cur, """
+            id, last_updated, product_name, user_email, quantity,
+            expected_date, status, comments, created_at
+        """, statuses, where, params, after, limit)
 
         # Format results
         orders = []
         for row in rows:
             orders.append({
                 "id": row[0],
-                "product_name": row[1],
-                "client_email": row[2],  # user_email from database
-                "quantity": row[3],
-                "expected_date": row[4],
-                "order_status": row[5],
-                "last_updated": row[6],
+                "product_name": row[2],
+                "client_email": row[3],  # user_email from database
+                "quantity": row[4],
+                "expected_date": row[5],
+                "order_status": row[6],
+                "last_updated": to_local_time(row[1]),
                 "comments": row[7] if row[7] else "",
-                "created_at": row[8]
+                "created_at": to_local_time(row[8])
             })
 
-        return jsonify(orders)
+        return with_next_cursor(jsonify(orders), next_cursor)
 
     except Exception as e:
         print(f"❌ Error in get_orders_by_category: {e}")
         return jsonify({"error": str(e)}), 500
 
 @app.route("/api/delivered-by-category")
+@admin_required
+@conditional_json("orders", "products")
 def delivered_by_category():
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cur = conn.cursor()
 
-    # 1 — Get delivered orders joined with product category
+    # 1 — Get delivered orders joined with product category; orders whose
+    # product has since been deleted are kept under "Other Products"
     cur.execute("""
         SELECT 
             o.id,
             o.product_name,
             o.user_email,
             o.last_updated,
-            p.category
+            COALESCE(p.category, 'Other Products') AS category
         FROM orders o
-        JOIN products p ON LOWER(o.product_name) = LOWER(p.product_name)
+        LEFT JOIN products p ON p.id = o.product_id
         WHERE o.status = 'delivered'
-        ORDER BY p.category, o.last_updated DESC
+        ORDER BY category, o.last_updated DESC
     """)
 
     rows = cur.fetchall()
-    conn.close()
 
     categories = {}
 
@@ -2002,7 +3959,7 @@ def delivered_by_category():
             "id": order_id,
             "product": product,
             "client": email,
-            "delivered_at": delivered_at
+            "delivered_at": to_local_time(delivered_at)
         })
 
     return jsonify(categories)
@@ -2013,53 +3970,82 @@ def delivered_by_category():
 
 
 @app.route("/api/orders/clients")
+@admin_required
+@conditional_json("orders")
 def get_client_orders():
-    """API endpoint to get all clients with their order details and product breakdown"""
-    if not session.get("authenticated") or not session.get("is_admin"):
-        return jsonify({"error": "Unauthorized"}), 401
+    """API endpoint to get all clients with their order details and product breakdown
+
+    Optional query args: page/per_page paginate the clients, top limits each
+    client's breakdown to their N most ordered products. The total number of
+    clients is returned in the X-Total-Count header.
+    """
+    per_page = request.args.get("per_page", type=int)
+    page = max(request.args.get("page", 1, type=int), 1)
+    top = request.args.get("top", type=int)
+    if top is not None and top < 1:
+        return jsonify({"error": "top must be at least 1"}), 400
+    limit = per_page if per_page and per_page > 0 else -1
+    offset = (page - 1) * per_page if limit > 0 else 0
 
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db()
         cur = conn.cursor()
 
-        # Get all clients with their total order counts
+        # Clients and their product breakdown in a single grouped query
         cur.execute("""
-            SELECT user_email, COUNT(*) as total_orders
-            FROM orders
-            GROUP BY user_email
-            ORDER BY total_orders DESC, user_email ASC
-        """)
-        clients = cur.fetchall()
-
-        # For each client, get their product breakdown
-        client_data = []
-        for client in clients:
-            email = client[0]
-            total_orders = client[1]
-
-            # Get product breakdown for this client
-            cur.execute("""
-                SELECT product_name, COUNT(*) as product_count
+            WITH product_counts AS (
+                SELECT user_email, product_name, COUNT(*) AS product_count
                 FROM orders
-                WHERE user_email = ?
-                GROUP BY product_name
-                ORDER BY product_count DESC
-            """, (email,))
-            products = cur.fetchall()
-
-            product_breakdown = [
-                {"product_name": p[0], "count": p[1]}
-                for p in products
-            ]
-
-            client_data.append({
-                "email": email,
-                "total_orders": total_orders,
-                "products": product_breakdown
-            })
+                GROUP BY user_email, product_name
+            ),
+            client_count AS (
+                SELECT COUNT(*) AS n FROM (SELECT 1 FROM product_counts GROUP BY user_email)
+            ),
+            client_totals AS (
+                SELECT user_email, SUM(product_count) AS total_orders
+                FROM product_counts
+                GROUP BY user_email
+                ORDER BY total_orders DESC, user_email ASC
+                LIMIT ? OFFSET ?
+            ),
+            ranked AS (
+                SELECT pc.user_email, pc.product_name, pc.product_count,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY pc.user_email
+                           ORDER BY pc.product_count DESC, pc.product_name
+                       ) AS product_rank
+                FROM product_counts pc
+                JOIN client_totals ct ON ct.user_email IS pc.user_email
+            )
+            SELECT cc.n, ct.user_email, ct.total_orders,
+                   r.product_name, r.product_count
+            FROM client_count cc
+            LEFT JOIN client_totals ct ON 1
+            LEFT JOIN ranked r ON r.user_email IS ct.user_email
+                              AND (? IS NULL OR r.product_rank <= ?)
+            ORDER BY ct.total_orders DESC, ct.user_email ASC, r.product_rank
+        """, (limit, offset, top, top))
+        rows = cur.fetchall()
 
-        conn.close()
-        return jsonify(client_data)
+        client_data = []
+        client_count = 0
+        for client_count, email, total_orders, product_name, product_count in rows:
+            if total_orders is None:
+                continue  # page past the last client
+            if not client_data or client_data[-1]["email"] != email:
+                client_data.append({
+                    "email": email,
+                    "total_orders": total_orders,
+                    "products": []
+                })
+            # No ranked row joined (the LEFT JOIN's empty side); a real product
+            # group always has a count, even when its product_name is NULL
+            if product_count is not None:
+                client_data[-1]["products"].append({"product_name": product_name, "count": product_count})
+
+        response = jsonify(client_data)
+        response.headers["X-Total-Count"] = str(client_count)
+        return response
 
     except Exception as e:
         print(f"❌ Error in get_client_orders: {e}")
@@ -2068,36 +4054,38 @@ def get_client_orders():
 
 
 @app.route("/api/timeline/months")
+@admin_required
+@conditional_json("orders")
 def get_timeline_months():
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cur = conn.cursor()
 
     cur.execute("""
-        SELECT DISTINCT strftime('%Y-%m', created_at) AS ym
+        SELECT DISTINCT created_month
         FROM orders
-        WHERE created_at >= '2025-10-01'
-        ORDER BY ym DESC
+        WHERE created_month >= '2025-10'
+        ORDER BY created_month DESC
     """)
 
     months = [row[0] for row in cur.fetchall()]
-    conn.close()
 
     return jsonify(months)
 
 @app.route("/api/timeline/orders/<month>")
+@admin_required
+@conditional_json("orders")
 def get_timeline_orders(month):
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cur = conn.cursor()
 
     cur.execute("""
         SELECT id, product_name, user_email, status, created_at
         FROM orders
-        WHERE strftime('%Y-%m', created_at) = ?
+        WHERE created_month = ?
         ORDER BY created_at DESC
     """, (month,))
 
     rows = cur.fetchall()
-    conn.close()
 
     results = [
         {
@@ -2105,53 +4093,54 @@ def get_timeline_orders(month):
             "product_name": r[1],
             "user_email": r[2],
             "status": r[3],
-            "created_at": r[4]
+            "created_at": to_local_time(r[4])
         }
         for r in rows
     ]
     return jsonify(results)
 @app.route("/api/payment-status")
+@admin_required
+@conditional_json("orders")
 def payment_status_api():
-    conn = sqlite3.connect(DATABASE)
+    try:
+        limit, after = page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    conn = get_db()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT id, product_name, user_email, quantity, status,
-               payment_status, created_at, last_updated
-        FROM orders
-        WHERE status IN ('order placed', 'dispatched', 'delivered')
-        ORDER BY last_updated DESC
-    """)
-    rows = cur.fetchall()
-    conn.close()
+    rows, next_cursor = fetch_orders_page(cur, """
+        id, last_updated, product_name, user_email, quantity, status,
+        payment_status, created_at
+    """, ("order placed", "dispatched", "delivered"), after=after, limit=limit)
 
     results = []
     for r in rows:
         results.append({
             "id": r[0],
-            "product_name": r[1],
-            "user_email": r[2],
-            "quantity": r[3],
-            "status": r[4],
-            "payment_status": r[5] or "unpaid",
-            "created_at": r[6],
-            "last_updated": r[7]
+            "product_name": r[2],
+            "user_email": r[3],
+            "quantity": r[4],
+            "status": r[5],
+            "payment_status": r[6] or "unpaid",
+            "created_at": to_local_time(r[7]),
+            "last_updated": to_local_time(r[1])
         })
 
-    return jsonify(results)
+    return with_next_cursor(jsonify(results), next_cursor)
 
 @app.route("/api/payment-status/update/<int:order_id>", methods=["POST"])
+@admin_required
 def update_payment_status(order_id):
     data = request.get_json()
     new_status = data.get("payment_status", "unpaid")
 
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db()
     cur = conn.cursor()
     cur.execute("""
         UPDATE orders SET payment_status = ?
         WHERE id = ?
     """, (new_status, order_id))
     conn.commit()
-    conn.close()
 
     return jsonify({"success": True})
 
@@ -2159,15 +4148,12 @@ def update_payment_status(order_id):
 
 
 def get_unread_message_count(user_email):
-    conn = sqlite3.connect(DATABASE)
+    """Unread messages for a user, read from the trigger-maintained counter"""
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT COUNT(*) FROM messages 
-        WHERE user_email = ? AND (is_read = 0 OR is_read IS NULL)
-    """, (user_email,))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    cursor.execute("SELECT unread FROM unread_counters WHERE user_email = ?", (user_email,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
 @app.route("/logout")
 def logout():
     """Logout route - clears session"""
@@ -2176,5 +4162,4 @@ def logout():
     return redirect(url_for("login"))
 
 if __name__ == "__main__":
-    init_db()
     app.run(debug=True)
@@ -0,0 +1,551 @@
+"""Load and latency benchmark for the portal.
+
+Builds a synthetic database at the requested scale, drives the client and
+admin routes with email going to the in-memory transport, and reports
+p50/p95/p99 latency and SQL statements issued per request for each route.
+
+    python benchmark.py --scale small -o bench.json
+    python benchmark.py --scale large --compare bench.json
+
+By default requests go through the Flask test client in this process. To
+measure a real server, start it on the same database and secret key and
+pass --base-url; query counts are then not available:
+
+    DATABASE_PATH=/tmp/bench.db ADMIN_EMAIL=admin@bench.example EMAIL_BACKEND=memory \
+        gunicorn -w 4 app:app
+    python benchmark.py --database /tmp/bench.db --base-url http://127.0.0.1:8000
+
+The repository database is never touched: without --database the data is
+generated in a temporary directory that is removed afterwards.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from fnmatch import fnmatch
+from urllib.parse import quote, urlencode, urlsplit
+
+SCALES = {
+    "tiny": {"products": 200, "orders": 2000, "messages": 500, "clients": 50},
+    "small": {"products": 1000, "orders": 20000, "messages": 5000, "clients": 200},
+    "medium": {"products": 5000, "orders": 200000, "messages": 50000, "clients": 2000},
+    "large": {"products": 10000, "orders": 1000000, "messages": 200000, "clients": 5000},
+}
+ADMIN_EMAIL = "admin@bench.example"
+BATCH_SIZE = 10000
+
+ORDER_STATUSES = (
+    ("inquiry received", 20), ("quote sent", 15), ("order placed", 15),
+    ("dispatched", 10), ("delivered", 35), ("cancelled", 5),
+)
+PRODUCT_NOUNS = ("Winch", "Cable Drum", "Splicing Machine", "Pulling Rope", "Fibre Cleaver",
+                 "Duct Rodder", "Cable Jack", "Tension Meter", "OTDR", "Trailer")
+PRODUCT_ADJECTIVES = ("Heavy Duty", "Compact", "Hydraulic", "Electric", "Portable",
+                      "Diesel", "Manual", "Automatic", "Industrial", "Lightweight")
+MATERIALS = ("Steel", "Aluminium", "Polyester", "Nylon", "Galvanised Steel")
+SEARCH_TERMS = ("winch", "cable", "fibre", "hydraulic", "drum", "rope", "compact", "spl", "diesel")
+
+
+# =========================
+# SYNTHETIC DATA
+# =========================
+def _timestamp(dt):
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _batched(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _insert(conn, label, sql, rows, total):
+    """executemany in batches, reporting progress on stderr"""
+    started = time.perf_counter()
+    done = 0
+    for batch in _batched(rows):
+        conn.executemany(sql, batch)
+        done += len(batch)
+        print(f"\r  {label}: {done}/{total}", end="", file=sys.stderr, flush=True)
+    print(f"\r  {label}: {done} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+def generate_dataset(conn, categories, scale, seed=0):
+    """Fill an empty, migrated database with clients, products, orders and messages"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    statuses = [status for status, _ in ORDER_STATUSES]
+    status_weights = [weight for _, weight in ORDER_STATUSES]
+
+    clients = [f"client{i}@bench.example" for i in range(1, scale["clients"] + 1)]
+    products = []
+    for i in range(1, scale["products"] + 1):
+        name = f"{rng.choice(PRODUCT_ADJECTIVES)} {rng.choice(PRODUCT_NOUNS)} {i}"
+        options = {
+            "Material": rng.choice(MATERIALS),
+            "Capacity": f"{rng.choice((1, 2, 3, 5, 8, 10, 15, 20))} Ton",
+            "Rope Diameter": f"{rng.choice((6, 8, 10, 12, 16))}mm",
+        }
+        if rng.random() < 0.5:
+            options["Engine Power"] = f"{rng.choice((5, 10, 15, 20, 30))} KW"
+        products.append((i, name, rng.choice(categories), json.dumps(options)))
+
+    conn.execute("BEGIN")
+    conn.execute("INSERT OR IGNORE INTO admins (email) VALUES (?)", (ADMIN_EMAIL,))
+    _insert(conn, "clients", """
+        INSERT INTO users (email, client_name, phone, address, company, user_type)
+        VALUES (?, ?, ?, ?, ?, 'client')
+    """, ((email, f"Client {i}", f"+9715{i:08d}", f"Warehouse {i}, Dubai", f"Company {i % 500}")
+          for i, email in enumerate(clients, 1)), len(clients))
+    _insert(conn, "products", """
+        INSERT INTO products (id, product_name, category, product_options, product_rate, stock_status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, ((pid, name, category, options, "On request", "in_stock" if rng.random() < 0.9 else "out_of_stock")
+          for pid, name, category, options in products), len(products))
+
+    # Each order's client and product are kept so messages can refer back to them
+    order_clients = []
+    order_products = []
+
+    def orders():
+        for _ in range(scale["orders"]):
+            client = rng.randrange(len(clients))
+            product = rng.randrange(len(products))
+            order_clients.append(client)
+            order_products.append(product)
+            created = now - timedelta(seconds=rng.randrange(730 * 86400))
+            updated = min(now, created + timedelta(seconds=rng.randrange(30 * 86400)))
+            status = rng.choices(statuses, status_weights)[0]
+            yield (products[product][0], products[product][1], _timestamp(created + timedelta(days=14))[:10],
+                   f"{rng.randint(1, 50)} items", "", clients[client], _timestamp(created), status,
+                   _timestamp(updated), "paid" if status == "delivered" and rng.random() < 0.7 else "unpaid")
+
+    _insert(conn, "orders", """
+        INSERT INTO orders (product_id, product_name, expected_date, quantity, comments,
+                            user_email, created_at, status, last_updated, payment_status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, orders(), scale["orders"])
+
+    def messages():
+        for _ in range(scale["messages"] if order_clients else 0):
+            order = rng.randrange(len(order_clients))
+            product_name = products[order_products[order]][1]
+            created = now - timedelta(seconds=rng.randrange(365 * 86400))
+            yield (order + 1, clients[order_clients[order]], f"Quotation for {product_name}",
+                   "Please find the quotation for your order attached.", product_name,
+                   f"{rng.randint(1, 50)} items", _timestamp(created), 0 if rng.random() < 0.1 else 1)
+
+    _insert(conn, "messages", """
+        INSERT INTO messages (order_id, user_email, subject, body, order_name, order_quantity, created_at, is_read)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, messages(), scale["messages"])
+    conn.commit()
+    conn.execute("ANALYZE")
+
+
+# =========================
+# SCENARIOS
+# =========================
+class Context:
+    """What the scenarios pick their parameters from, read once from the database"""
+    def __init__(self, conn, seed=0):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.clients = [row[0] for row in conn.execute(
+            "SELECT email FROM users WHERE user_type = 'client' ORDER BY id")]
+        self.categories = [row[0] for row in conn.execute(
+            "SELECT DISTINCT category FROM products ORDER BY category")]
+        self.product_ids = [row[0] for row in conn.execute("SELECT id FROM products ORDER BY id")]
+        self.months = [row[0] for row in conn.execute(
+            "SELECT DISTINCT created_month FROM orders ORDER BY created_month DESC LIMIT 24")]
+        self.order_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM orders ORDER BY id DESC LIMIT 5000")]
+        # Orders the dispatch scenario may move on, each used once
+        self.placed_orders = [row[0] for row in conn.execute(
+            "SELECT id FROM orders WHERE status = 'order placed' ORDER BY id DESC LIMIT 20000")]
+
+    def choice(self, values):
+        with self.lock:
+            return self.rng.choice(values) if values else None
+
+    def reseed(self, name):
+        """Same parameter sequence for a route whichever other routes run"""
+        with self.lock:
+            self.rng = random.Random(f"{self.seed}:{name}")
+
+    def pop_placed_order(self):
+        with self.lock:
+            return self.placed_orders.pop() if self.placed_orders else None
+
+
+def _client(ctx):
+    return {"authenticated": True, "user_email": ctx.choice(ctx.clients), "is_admin": False, "user_type": "client"}
+
+
+def _admin(ctx):
+    return {"authenticated": True, "user_email": ADMIN_EMAIL, "is_admin": True, "user_type": "admin"}
+
+
+def _place_order(ctx):
+    return {"product_id": ctx.choice(ctx.product_ids), "expected_date": "2030-01-15",
+            "quantity_value": "3", "quantity_unit": "items", "comments": "benchmark"}
+
+
+def _dispatch_path(ctx):
+    order_id = ctx.pop_placed_order()
+    return None if order_id is None else f"/admin/dispatch-order/{order_id}"
+
+
+# name, session, method, path (str or callable), form data (callable), expected status
+SCENARIOS = [
+    ("dashboard", _client, "GET", "/dashboard", None, 200),
+    ("my_orders", _client, "GET", "/my-orders", None, 200),
+    ("my_messages", _client, "GET", "/my-messages", None, 200),
+    ("unread_count", _client, "GET", "/api/unread-count", None, 200),
+    ("products_by_category", _client, "GET",
+     lambda ctx: f"/api/products/{quote(ctx.choice(ctx.categories) or 'none', safe='')}", None, 200),
+    ("product_search", _client, "GET", lambda ctx: f"/api/products/search?q={ctx.choice(SEARCH_TERMS)}", None, 200),
+    ("product_facets", _client, "GET",
+     lambda ctx: f"/api/products/facets?category={quote(ctx.choice(ctx.categories) or '')}", None, 200),
+    ("admin", _admin, "GET", "/admin", None, 200),
+    ("admin_list", _admin, "GET", "/admin_list", None, 200),
+    ("client_orders", _admin, "GET", "/admin/client-orders", None, 200),
+    ("manage_products", _admin, "GET", "/admin/manage-products", None, 200),
+    ("manage_clients", _admin, "GET", "/admin/manage-clients", None, 200),
+    ("manage_categories", _admin, "GET", "/admin/categories", None, 200),
+    ("orders_inquired", _admin, "GET", "/api/orders/inquired", None, 200),
+    ("dashboard_data", _admin, "GET", "/api/dashboard-data", None, 200),
+    ("orders_week", _admin, "GET", "/api/orders/week", None, 200),
+    ("orders_pending", _admin, "GET", "/api/orders/pending", None, 200),
+    ("orders_delivered", _admin, "GET", "/api/orders/delivered", None, 200),
+    ("delivered_by_category", _admin, "GET", "/api/delivered-by-category", None, 200),
+    ("orders_clients", _admin, "GET", "/api/orders/clients", None, 200),
+    ("orders_clients_page", _admin, "GET", "/api/orders/clients?per_page=50&top=5", None, 200),
+    ("timeline_months", _admin, "GET", "/api/timeline/months", None, 200),
+    ("timeline_orders", _admin, "GET", lambda ctx: f"/api/timeline/orders/{ctx.choice(ctx.months)}", None, 200),
+    ("payment_status", _admin, "GET", "/api/payment-status", None, 200),
+    # Writes last, so every read above sees the same generated data
+    ("place_order", _client, "POST", "/place_order", _place_order, 302),
+    ("dispatch_order", _admin, "POST", _dispatch_path, None, 302),
+]
+
+
+# =========================
+# QUERY COUNTING
+# =========================
+# "queries" is the number of execute()/executemany() calls the app made
+# while handling a request, taken from app.py's per-request SQL stats.
+# Statements SQLite runs on its own behalf (trigger bodies, FTS5 shadow
+# tables) are not included and an executemany counts once, so the number
+# only moves when the code issues more or fewer statements.
+_query_counts = threading.local()
+
+
+def install_query_counter(app_module):
+    """Have the app count each request's SQL statements and hand them back here"""
+    app = app_module.app
+    app.config["RECORD_SQL_STATS"] = True
+
+    @app.after_request
+    def keep_query_count(response):
+        stats = app_module.g.get("sql_stats")
+        _query_counts.value = stats[0] if stats else None
+        return response
+
+
+# =========================
+# DRIVERS
+# =========================
+class TestClientDriver:
+    """Requests through app.test_client(), one client per thread"""
+    counts_queries = True
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, session, data):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess.clear()
+            sess.update(session)
+        _query_counts.value = None
+        started = time.perf_counter()
+        response = client.open(path, method=method, data=data)
+        response.get_data()
+        elapsed = time.perf_counter() - started
+        response.close()
+        return response.status_code, elapsed, _query_counts.value
+
+
+class HTTPDriver:
+    """Requests to a running server over keep-alive connections, one per thread"""
+    counts_queries = False
+
+    def __init__(self, app, base_url):
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        # Sessions are signed cookies, so one signed with the same secret key
+        # stands in for logging in through the OTP flow
+        self.serializer = app.session_interface.get_signing_serializer(app)
+        self.cookie_name = app.config["SESSION_COOKIE_NAME"]
+        self._local = threading.local()
+
+    def request(self, method, path, session, data):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.connection_class(self.netloc, timeout=60)
+        headers = {"Cookie": f"{self.cookie_name}={self.serializer.dumps(session)}"}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        started = time.perf_counter()
+        try:
+            conn.request(method, self.prefix + path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+        return response.status, time.perf_counter() - started, None
+
+
+# =========================
+# RUNNING AND REPORTING
+# =========================
+def percentile(sorted_values, fraction):
+    """Linear interpolation between closest ranks, as numpy's default"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def run_scenario(driver, ctx, scenario, iterations, warmup, concurrency):
+    name, make_session, method, path, make_data, expected = scenario
+    ctx.reseed(name)
+
+    def one(_):
+        request_path = path(ctx) if callable(path) else path
+        if request_path is None:
+            return None
+        try:
+            return driver.request(method, request_path, make_session(ctx), make_data(ctx) if make_data else None)
+        except Exception as e:
+            return repr(e), None, None
+
+    for i in range(warmup):
+        one(i)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = [sample for sample in pool.map(one, range(iterations)) if sample is not None]
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for status, elapsed, _ in samples if status == expected)
+    errors = {}
+    for status, _, _ in samples:
+        if status != expected:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    queries = [count for status, _, count in samples if status == expected and count is not None]
+    return {
+        "path": path if isinstance(path, str) else f"<{method} {name}>",
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / wall, 1) if wall else None,
+        "mean_ms": round(statistics.fmean(latencies), 3) if latencies else None,
+        "p50_ms": _round(percentile(latencies, 0.50)),
+        "p95_ms": _round(percentile(latencies, 0.95)),
+        "p99_ms": _round(percentile(latencies, 0.99)),
+        "max_ms": _round(latencies[-1] if latencies else None),
+        "queries_mean": round(statistics.fmean(queries), 2) if queries else None,
+        "queries_max": max(queries) if queries else None,
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _format(value, suffix=""):
+    return "-" if value is None else f"{value:.2f}{suffix}" if isinstance(value, float) else f"{value}{suffix}"
+
+
+def print_report(results, previous=None, threshold=0.2):
+    """Table of the results, with changes against `previous` where it has the route.
+
+    Returns the routes whose p95 grew by more than `threshold` or that now run
+    more queries per request.
+    """
+    regressions = []
+    header = f"{'route':<24}{'reqs':>6}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}"
+    if previous:
+        header += f"{'p95 Δ':>9}{'queries Δ':>11}"
+    print(header)
+    for name, stats in results["routes"].items():
+        line = (f"{name:<24}{stats['requests']:>6}{sum(stats['errors'].values()):>5}"
+                f"{_format(stats['p50_ms']):>10}{_format(stats['p95_ms']):>10}{_format(stats['p99_ms']):>10}"
+                f"{_format(stats['queries_mean']):>9}")
+        before = (previous or {}).get("routes", {}).get(name)
+        if before:
+            p95_change = None
+            if stats["p95_ms"] and before.get("p95_ms"):
+                p95_change = stats["p95_ms"] / before["p95_ms"] - 1
+            query_change = None
+            if stats["queries_mean"] is not None and before.get("queries_mean") is not None:
+                query_change = stats["queries_mean"] - before["queries_mean"]
+            line += f"{'-' if p95_change is None else f'{p95_change:+.0%}':>9}"
+            line += f"{'-' if query_change is None else f'{query_change:+.2f}':>11}"
+            if (p95_change is not None and p95_change > threshold) or (query_change or 0) > 0:
+                regressions.append(name)
+                line += "  <- regression"
+        print(line)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=SCALES, default="small", help="dataset size preset (default: small)")
+    for table in ("products", "orders", "messages", "clients"):
+        parser.add_argument(f"--{table}", type=int, help=f"override the number of {table}")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for data and request parameters")
+    parser.add_argument("--database", help="database file to use; generated if it does not exist, "
+                                           "reused as-is if it does (default: a temporary file)")
+    parser.add_argument("--base-url", help="benchmark a running server instead of the test client")
+    parser.add_argument("-n", "--iterations", type=int, default=50, help="measured requests per route")
+    parser.add_argument("--warmup", type=int, default=3, help="unmeasured requests per route first")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="requests in flight at once")
+    parser.add_argument("--routes", help="comma separated route names or globs to run (default: all)")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="p95 growth counted as a regression in --compare (default: 0.2)")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with status 1 when --compare finds a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scale = dict(SCALES[args.scale])
+    for table in scale:
+        if getattr(args, table) is not None:
+            scale[table] = getattr(args, table)
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+
+    temp_dir = None
+    database = args.database
+    if not database:
+        temp_dir = tempfile.mkdtemp(prefix="b2b-benchmark-")
+        database = os.path.join(temp_dir, "database.db")
+    generate = not os.path.exists(database)
+
+    # app reads these at import time and migrates DATABASE_PATH straight away
+    os.environ["DATABASE_PATH"] = os.path.abspath(database)
+    os.environ["EMAIL_BACKEND"] = "memory"
+    os.environ["EMAIL_WORKERS"] = "0"
+    os.environ.setdefault("ADMIN_EMAIL", ADMIN_EMAIL)
+    os.environ.setdefault("SENDER_GMAIL_ADDRS", "noreply@bench.example")
+    try:
+        import app as app_module
+
+        conn = sqlite3.connect(database, isolation_level=None)
+        generate_seconds = None
+        if generate:
+            print(f"Generating {scale} in {database}", file=sys.stderr)
+            started = time.perf_counter()
+            generate_dataset(conn, app_module.load_categories(conn), scale, args.seed)
+            generate_seconds = round(time.perf_counter() - started, 2)
+        conn.execute("INSERT OR IGNORE INTO admins (email) VALUES (?)", (ADMIN_EMAIL,))
+        ctx = Context(conn, args.seed)
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("products", "orders", "messages", "users")}
+        conn.close()
+
+        if args.base_url:
+            driver = HTTPDriver(app_module.app, args.base_url)
+        else:
+            install_query_counter(app_module)
+            driver = TestClientDriver(app_module.app)
+
+        patterns = [pattern.strip() for pattern in args.routes.split(",")] if args.routes else ["*"]
+        results = {
+            "meta": {
+                "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "revision": git_revision(),
+                "python": platform.python_version(),
+                "sqlite": sqlite3.sqlite_version,
+                "driver": args.base_url or "test_client",
+                "iterations": args.iterations,
+                "warmup": args.warmup,
+                "concurrency": args.concurrency,
+                "seed": args.seed,
+                "rows": counts,
+                "generate_seconds": generate_seconds,
+            },
+            "routes": {},
+        }
+        for scenario in SCENARIOS:
+            if not any(fnmatch(scenario[0], pattern) for pattern in patterns):
+                continue
+            print(f"  {scenario[0]}", file=sys.stderr)
+            results["routes"][scenario[0]] = run_scenario(
+                driver, ctx, scenario, args.iterations, args.warmup, max(1, args.concurrency))
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    regressions = print_report(results, previous, args.threshold)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    failed = [name for name, stats in results["routes"].items() if stats["errors"]]
+    if failed:
+        print("Unexpected responses from: " + ", ".join(failed), file=sys.stderr)
+    if regressions:
+        print("Regressed against " + args.compare + ": " + ", ".join(regressions), file=sys.stderr)
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""gunicorn settings, picked up automatically from the working directory.
+
+Workers share Prometheus metrics through files in PROMETHEUS_MULTIPROC_DIR
+(see metrics.py); the directory is emptied when the master starts so counts
+from an earlier run are not merged in, and a dead worker's live samples are
+dropped when it exits.
+"""
+import os
+import shutil
+
+# Every open dashboard, orders or messages tab holds a request on
+# /api/unread-stream for up to UNREAD_STREAM_MAX_SECONDS, one thread each.
+# Threaded workers keep those from pinning the whole worker, and each worker
+# serves at most UNREAD_STREAM_LIMIT streams (half its threads by default)
+# so the other half always answers ordinary requests. Tabs past the limit
+# get a 204 and poll /api/unread-count every 30s instead, so the portal
+# takes workers * UNREAD_STREAM_LIMIT live streams before tabs start polling.
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+os.environ.setdefault("UNREAD_STREAM_LIMIT", str(threads // 2))
+
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "prometheus"))
+
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,78 @@
+"""Resized WebP/AVIF copies of product images.
+
+This lives outside app.py so the process pool that runs it never imports the
+Flask app. Pillow is optional: without it no variants are produced and the
+templates keep serving the original upload.
+"""
+import os
+import re
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+VARIANT_WIDTHS = (320, 640)
+SAVE_OPTIONS = {
+    "avif": {"quality": 55},
+    "webp": {"quality": 80, "method": 4},
+}
+
+
+def available_formats():
+    """Formats this Pillow build can write, best first"""
+    if Image is None:
+        return ()
+    formats = []
+    if ".avif" in Image.registered_extensions():
+        formats.append("avif")
+    if features.check("webp"):
+        formats.append("webp")
+    return tuple(formats)
+
+
+def variant_filename(image_filename, width, fmt):
+    return f"{os.path.splitext(image_filename)[0]}-{width}.{fmt}"
+
+
+def generate_variants(source_path, output_dir):
+    """Write every width/format no larger than the original.
+
+    Returns {format: [widths]} for the files written.
+    """
+    formats = available_formats()
+    if not formats:
+        return {}
+    os.makedirs(output_dir, exist_ok=True)
+    image_filename = os.path.basename(source_path)
+    variants = {}
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+        # Skip sizes barely below the original; it stands in for them instead
+        widths = {width for width in VARIANT_WIDTHS if width < image.width * 0.9}
+        widths.add(min(image.width, VARIANT_WIDTHS[-1]))
+        for width in sorted(widths):
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                path = os.path.join(output_dir, variant_filename(image_filename, width, fmt))
+                # Write aside and rename so a half-written file is never served;
+                # the pid keeps two jobs for the same shared upload apart
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                resized.save(temp_path, format=fmt.upper(), **SAVE_OPTIONS[fmt])
+                os.replace(temp_path, path)
+                variants.setdefault(fmt, []).append(width)
+    return variants
+
+
+def remove_variants(image_filename, output_dir):
+    pattern = re.compile(re.escape(os.path.splitext(image_filename)[0]) + r"-\d+\.(avif|webp)$")
+    try:
+        names = os.listdir(output_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if pattern.match(name):
+            os.remove(os.path.join(output_dir, name))
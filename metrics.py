@@ -0,0 +1,70 @@
+"""Prometheus metrics for the portal.
+
+prometheus_client is optional: without it every metric here is a no-op and
+/metrics answers 404. Under gunicorn each worker writes its samples to
+PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py sets it up) and a scrape merges
+them, so it does not matter which worker answers.
+"""
+import os
+
+try:
+    from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                                   generate_latest, multiprocess)
+except ImportError:
+    Counter = Histogram = None
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR and Counter is not None:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+EMAIL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _NullMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, amount):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+def _metric(kind, name, documentation, labelnames=(), **kwargs):
+    if kind is None:
+        return _NullMetric()
+    return kind(name, documentation, labelnames, **kwargs)
+
+
+enabled = Counter is not None
+
+REQUEST_LATENCY = _metric(Histogram, "http_request_duration_seconds",
+                          "Time from the start of a request to its response, per endpoint",
+                          ("method", "endpoint"), buckets=LATENCY_BUCKETS)
+REQUESTS = _metric(Counter, "http_requests",
+                   "Responses sent, per endpoint and status code",
+                   ("method", "endpoint", "status"))
+REQUEST_SQL_QUERIES = _metric(Histogram, "http_request_sql_queries",
+                              "SQL statements executed while handling a request",
+                              ("endpoint",), buckets=QUERY_COUNT_BUCKETS)
+REQUEST_SQL_TIME = _metric(Histogram, "http_request_sql_duration_seconds",
+                           "Time spent executing SQL statements while handling a request",
+                           ("endpoint",), buckets=LATENCY_BUCKETS)
+UNREAD_COUNT_TIME = _metric(Histogram, "unread_count_lookup_duration_seconds",
+                            "Time inject_unread_count spends looking up the badge count for a page",
+                            buckets=LATENCY_BUCKETS)
+EMAIL_SEND_TIME = _metric(Histogram, "email_send_duration_seconds",
+                          "Time to hand one outbox message to the email transport",
+                          ("backend", "outcome"), buckets=EMAIL_BUCKETS)
+
+
+def render():
+    """(body, content type) for a scrape of this process, or of all workers"""
+    registry = REGISTRY
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,41 +1,14 @@
-import sqlite3, json
-from app import DATABASE
+import json
+from app import import_catalogue
 
+# Safe to re-run: products are matched by id and only changed rows are written.
+# `flask catalogue import <file>` does the same for any JSON or CSV catalogue.
 with open("additional_products.json", "r") as f:
     products = json.load(f)
 
-conn = sqlite3.connect(DATABASE)
-cursor = conn.cursor()
-
-# Ensure products table exists
-cursor.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_name TEXT NOT NULL,
-            category TEXT NOT NULL,
-            product_options TEXT,
-            product_rate TEXT,
-            stock_status TEXT NOT NULL,
-            image_filename TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-
-# Insert products
-for p in products:
-    cursor.execute("""
-        INSERT INTO products (id, product_name, category, product_options, product_rate, stock_status, image_filename)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (
-        p.get("id"),
-        p["name"],
-        p["category"],
-        json.dumps(p.get("options", {})),
-        p.get("rate", ""),
-        p.get("stock", "in_stock"),
-        p.get("image", "")
-    ))
-conn.commit()
-conn.close()
-print("✅ Products loaded from products.json")
\ No newline at end of file
+result = import_catalogue(products)
+if result["errors"]:
+    print("❌ Nothing loaded:", *result["errors"], sep="\n  ")
+else:
+    print(f"✅ Products loaded from additional_products.json "
+          f"({result['inserted']} new, {result['updated']} updated, {result['unchanged']} unchanged)")